@@ -0,0 +1,309 @@
+"""
+Matching benchmark against SQLite with deterministic synthetic populations.
+
+    python benchmarks/match_benchmark.py                      # 1k, 10k, 100k, 1M users
+    python benchmarks/match_benchmark.py --sizes 1000 10000 --output bench.json
+    python benchmarks/match_benchmark.py --baseline bench.json  # show change against an earlier run
+
+Populations are built from the trait vocabulary of main.LOVE_SEED_USERS plus
+numbered picklist values, with the same seed always giving the same database.
+A share of users copy one of a few popular preference sets, as the app's
+fixed picklists make identical preferences common.
+Databases are kept in --db-dir and reused by later runs. Each size runs in its
+own process so peak memory and the per-process pools/caches do not leak
+between sizes.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def latency_summary(samples, elapsed):
+    return {
+        "count": len(samples),
+        "throughput_per_s": round(len(samples) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+# --- Synthetic population ---
+
+def build_vocabulary(seed_users, extra_values):
+    """Picklists per field: every value used by the seed users plus numbered extras."""
+    from core.matching import EXACT_FIELDS, LIST_FIELDS, split_traits
+
+    exact, lists = {}, {}
+    for _, field in EXACT_FIELDS:
+        values = set()
+        for data in seed_users:
+            for section in ("love_basic_info", "personality", "matchpreference"):
+                if data.get(section, {}).get(field):
+                    values.add(data[section][field])
+        if field == "age_range":
+            values.update(f"{18 + 3 * n}-{25 + 4 * n}" for n in range(extra_values))
+        else:
+            values.update(f"{field.replace('_', ' ').title()} {n}" for n in range(extra_values))
+        exact[field] = sorted(values)
+
+    for field in LIST_FIELDS:
+        tokens = set()
+        for data in seed_users:
+            for section in ("personality", "matchpreference"):
+                tokens |= split_traits(data.get(section, {}).get(field))
+        tokens.update(f"{field} {n}" for n in range(extra_values))
+        lists[field] = sorted(tokens)
+    return exact, lists
+
+
+def generate_population(size, seed, extra_values, popular_share, batch_size=10000):
+    """Insert `size` love users with basic info, personality and preferences."""
+    from main import LOVE_SEED_USERS
+    from core.extensions import db
+    from core.matching import EXACT_FIELDS, LIST_FIELDS, preference_signature, parse_age_range
+    from core.geo import resolve_location, grid_cell
+    from core.traits import MODEL_TRAIT_FIELDS, trait_id
+    from core.models import User, LoveBasicInfo, UserPersonality, MatchPreference
+
+    rng = random.Random(seed)
+    locations = ["New York", "Toronto", "Lagos", "Abuja", "Ibadan", "Nairobi", "Mombasa", "Accra", "London", "Manchester"]
+    exact, lists = build_vocabulary(LOVE_SEED_USERS, extra_values)
+    value_ids = {}
+    love_fields = [field for model, field in EXACT_FIELDS if model is LoveBasicInfo]
+    personality_fields = [field for model, field in EXACT_FIELDS if model is UserPersonality]
+
+    def with_trait_ids(model, row):
+        # Bulk inserts skip the mapper listeners, so picklist ids are added here
+        for field in MODEL_TRAIT_FIELDS[model]:
+            row[f"{field}_id"] = trait_id(db.session.connection(), field, row[field], value_ids)
+        return row
+
+    def pick_list(field, low, high):
+        tokens = rng.sample(lists[field], rng.randint(low, min(high, len(lists[field]))))
+        return ", ".join(tokens), {field: sorted(tokens)}
+
+    def pick_preference():
+        # Like the app's forms, a preference leaves some fields open
+        preference = {"trait_tokens": {}}
+        for _, field in EXACT_FIELDS:
+            preference[field] = rng.choice(exact[field]) if rng.random() < 0.7 else None
+        for field in LIST_FIELDS:
+            preference[field], tokens = pick_list(field, 0, 4)
+            preference["trait_tokens"].update(tokens)
+        preference["signature"] = preference_signature(SimpleNamespace(**preference))
+        preference["age_min"], preference["age_max"] = parse_age_range(preference["age_range"])
+        return preference
+
+    popular = [pick_preference() for _ in range(20)]
+
+    for start in range(1, size + 1, batch_size):
+        users, infos, personalities, preferences = [], [], [], []
+        for user_id in range(start, min(start + batch_size, size + 1)):
+            users.append({
+                "id": user_id,
+                "email": f"bench{user_id}@example.com",
+                "username": f"bench{user_id}",
+                "account_type": "love",
+                "referral_points": 0,
+            })
+
+            born = date(rng.randint(1960, 2005), rng.randint(1, 12), rng.randint(1, 28))
+            location = rng.choice(locations)
+            region, latitude, longitude = resolve_location(location)
+            info = {"user_id": user_id, "nickname": f"Bench {user_id}", "fullname": f"Bench User {user_id}",
+                    "date_of_birth": born, "birth_year": born.year, "current_location": location,
+                    "region": region, "latitude": latitude, "longitude": longitude,
+                    "geo_cell": grid_cell(latitude, longitude)}
+            info.update({field: rng.choice(exact[field]) for field in love_fields})
+            infos.append(info)
+
+            personality = {"user_id": user_id, "trait_tokens": {}}
+            personality.update({field: rng.choice(exact[field]) for field in personality_fields})
+            for field in LIST_FIELDS:
+                personality[field], tokens = pick_list(field, 1, 5)
+                personality["trait_tokens"].update(tokens)
+            personalities.append(personality)
+
+            preference = dict(rng.choice(popular)) if rng.random() < popular_share else pick_preference()
+            preference["user_id"] = user_id
+            preferences.append(preference)
+
+        db.session.execute(db.insert(User), users)
+        db.session.execute(db.insert(LoveBasicInfo), [with_trait_ids(LoveBasicInfo, row) for row in infos])
+        db.session.execute(db.insert(UserPersonality), [with_trait_ids(UserPersonality, row) for row in personalities])
+        db.session.execute(db.insert(MatchPreference), [with_trait_ids(MatchPreference, row) for row in preferences])
+        db.session.commit()
+
+
+# --- One population, run in its own process ---
+
+def run_single(size, args):
+    os.makedirs(args.db_dir, exist_ok=True)
+    db_path = os.path.join(args.db_dir, f"match_bench_{size}_{args.seed}_{args.extra_values}_{args.popular_share}.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("JWT_SECRET_KEY", "match-benchmark-secret-key-0123456789")
+    sys.path.insert(0, ROOT)
+
+    from flask_jwt_extended import create_access_token
+    from main import app, calculate_match_score
+    from core.extensions import db
+    from core.match_cache import match_cache
+    from core.matching import load_match_pool, preference_signature
+    from core.models import User, MatchPreference, MatchScore
+    from core.schema import upgrade_schema
+
+    result = {"size": size, "seed": args.seed}
+    rng = random.Random(args.seed + 1)
+
+    with app.app_context():
+        # 1. Population, generated once per (size, seed, vocabulary, sharing)
+        generate = not os.path.exists(db_path)
+        upgrade_schema()
+        if generate:
+            started = time.perf_counter()
+            generate_population(size, args.seed, args.extra_values, args.popular_share)
+            result["generate_s"] = round(time.perf_counter() - started, 2)
+
+        # 2. Scalar calculate_match_score over a sample of pairs
+        owners = User.query.order_by(User.id).limit(args.score_owners).all()
+        candidates = User.query.filter(User.id.in_(rng.sample(range(1, size + 1), min(size, args.score_candidates)))).all()
+        samples = []
+        started = time.perf_counter()
+        for owner in owners:
+            for candidate in candidates:
+                call_started = time.perf_counter()
+                calculate_match_score(owner.matchpreference, candidate, candidate.personality)
+                samples.append(time.perf_counter() - call_started)
+        result["calculate_match_score"] = latency_summary(samples, time.perf_counter() - started)
+        db.session.remove()
+
+        # 3. Building the in-memory pool
+        tracemalloc.start()
+        started = time.perf_counter()
+        load_match_pool("love")
+        result["pool_build_s"] = round(time.perf_counter() - started, 3)
+        result["pool_build_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+
+        user_ids = rng.sample(range(1, size + 1), min(size, args.requests))
+        tokens = {user_id: create_access_token(identity=str(user_id)) for user_id in user_ids}
+
+    client = app.test_client()
+
+    def time_requests(prepare=None):
+        samples = []
+        started = time.perf_counter()
+        for user_id in user_ids:
+            if prepare:
+                prepare(user_id)
+            request_started = time.perf_counter()
+            response = client.get(f"/matches?limit={args.limit}", headers={"Authorization": f"Bearer {tokens[user_id]}"})
+            samples.append(time.perf_counter() - request_started)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        return latency_summary(samples, sum(samples)), time.perf_counter() - started
+
+    def forget(user_id):
+        with app.app_context():
+            preferences = MatchPreference.query.filter_by(user_id=user_id).first()
+            MatchScore.query.filter_by(signature=preference_signature(preferences)).delete()
+            db.session.commit()
+        match_cache.invalidate([user_id])
+
+    # 4. get_matches end to end: list computed on read, then served from the cache
+    for mode in args.modes:
+        app.config["MATCH_SCORING_MODE"] = mode
+        result[f"get_matches_cold_{mode}"], _ = time_requests(prepare=forget)
+    result["get_matches_cached"], _ = time_requests()
+
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+# --- Reporting ---
+
+def flatten(result, prefix=""):
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and key not in ("size", "seed", "count"):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def report(results, baseline=None):
+    previous = {entry["size"]: flatten(entry) for entry in (baseline or {}).get("results", [])}
+    for result in results:
+        print(f"\n== {result['size']:,} users ==")
+        before = previous.get(result["size"], {})
+        for key, value in flatten(result).items():
+            line = f"  {key:<42} {value:>12}"
+            if key in before and before[key]:
+                line += f"   ({(value - before[key]) / before[key] * 100:+.1f}% vs baseline)"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--extra-values", type=int, default=12, help="numbered picklist values added per field")
+    parser.add_argument("--popular-share", type=float, default=0.3, help="fraction of users copying a popular preference set")
+    parser.add_argument("--requests", type=int, default=200, help="/matches requests per measurement")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", default=["pool", "sql"], help="MATCH_SCORING_MODE values to time")
+    parser.add_argument("--score-owners", type=int, default=20)
+    parser.add_argument("--score-candidates", type=int, default=500)
+    parser.add_argument("--db-dir", default=os.path.join(tempfile.gettempdir(), "everkonnect-bench"))
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args)))
+        return
+
+    results = []
+    for size in args.sizes:
+        command =[sys.executable, os.path.abspath(__file__), "--single", str(size),
+                   "--seed", str(args.seed), "--extra-values", str(args.extra_values),
+                   "--popular-share", str(args.popular_share),
+                   "--requests", str(args.requests), "--limit", str(args.limit),
+                   "--score-owners", str(args.score_owners), "--score-candidates", str(args.score_candidates),
+                   "--db-dir", args.db_dir, "--modes", *args.modes]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import hashlib
+import importlib
+import io
+import os
+import tempfile
+import urllib.request
+import cloudinary.uploader
+import cloudinary.utils
+from sqlalchemy import inspect
+from core.imports import base64, filetype, Image
+from core.extensions import db
+from core.models import User
+
+
+# Profile pictures are stored as raw bytes under the SHA-256 of their content,
+# so the same picture is stored once and a stored blob never changes. The
+# user row keeps only the hash. BLOB_STORE_BACKEND picks where blobs live:
+# "local" (files under BLOB_STORE_PATH), "cloudinary", or "package.module:Class"
+# for any class with the same methods taking the app config. Clients load
+# pictures by URL, from the backend when it is public or from /api/images
+# (see core.thumbnails for the resized copies).
+
+
+def blob_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    """Blobs as files under a directory, fanned out by the first hash characters."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        digest = blob_hash(data)
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so a reader never sees half a blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        blob = self.open(digest)
+        if blob is None:
+            return None
+        with blob:
+            return blob.read()
+
+    def open(self, digest):
+        """The blob as a binary file object, for streaming."""
+        try:
+            return open(self._path(digest), "rb")
+        except FileNotFoundError:
+            return None
+
+    def url(self, digest):
+        """Public URL of a blob, None when it is only served through the app."""
+        return None
+
+
+class CloudinaryBlobStore:
+    """Blobs as raw Cloudinary resources named by their hash, using the account from core.config."""
+
+    def __init__(self, folder="blobs"):
+        self.folder = folder
+
+    def _public_id(self, digest):
+        return f"{self.folder}/{digest}"
+
+    def put(self, data):
+        digest = blob_hash(data)
+        cloudinary.uploader.upload(
+            data, public_id=self._public_id(digest), resource_type="raw", overwrite=False, unique_filename=False
+        )
+        return digest
+
+    def get(self, digest):
+        try:
+            with urllib.request.urlopen(self.url(digest), timeout=10) as response:
+                return response.read()
+        except Exception:
+            return None
+
+    def open(self, digest):
+        data = self.get(digest)
+        return io.BytesIO(data) if data is not None else None
+
+    def url(self, digest):
+        return cloudinary.utils.cloudinary_url(self._public_id(digest), resource_type="raw", secure=True)[0]
+
+
+class BlobStore:
+    """Content-addressed picture storage, in the backend BLOB_STORE_BACKEND names."""
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        backend = app.config.get("BLOB_STORE_BACKEND", "local")
+        if backend == "local":
+            self.backend = LocalBlobStore(app.config.get("BLOB_STORE_PATH") or os.path.join(app.instance_path, "blobs"))
+        elif backend == "cloudinary":
+            self.backend = CloudinaryBlobStore(app.config.get("BLOB_STORE_FOLDER", "blobs"))
+        else:
+            module, _, name = backend.partition(":")
+            self.backend = getattr(importlib.import_module(module), name)(app.config)
+
+    def put(self, data):
+        """Store bytes and return their hash."""
+        return self.backend.put(data)
+
+    def get(self, digest):
+        """Bytes stored under a hash, None when missing."""
+        return self.backend.get(digest) if digest else None
+
+    def open(self, digest):
+        """Binary file object of a blob, None when missing."""
+        return self.backend.open(digest) if digest else None
+
+    def url(self, digest):
+        """Where clients can fetch a blob directly, None when the app serves it."""
+        return self.backend.url(digest) if digest else None
+
+
+blob_store = BlobStore()
+
+
+def image_mime_type(head):
+    """MIME type of an image from its first bytes, JPEG when unknown."""
+    kind = filetype.guess(head)
+    return kind.mime if kind and kind.mime.startswith("image/") else "image/jpeg"
+
+
+def set_profile_pic(user, image_bytes, image=None):
+    """Store a picture as the user's profile picture and record its metadata."""
+    user.profile_pic_hash = blob_store.put(image_bytes)
+    set_profile_pic_metadata(user, image_bytes, image)
+
+
+def set_profile_pic_metadata(user, image_bytes, image=None):
+    """
+    Record the MIME type, dimensions and size of the user's profile picture.
+
+    `image` is the picture already opened with PIL, if the caller has it; only
+    its header is read here, so passing nothing costs no decoding either.
+    """
+    if image is None:
+        image = Image.open(io.BytesIO(image_bytes))
+    user.profile_pic_mime = Image.MIME.get(image.format) or image_mime_type(image_bytes[:262])
+    user.profile_pic_width, user.profile_pic_height = image.size
+    user.profile_pic_bytes = len(image_bytes)
+
+
+def profile_pic_mime_type(digest):
+    """Recorded MIME type of a stored profile picture, None when no user has it on record."""
+    return db.session.execute(
+        db.select(User.profile_pic_mime)
+        .where(User.profile_pic_hash == digest, User.profile_pic_mime.isnot(None))
+        .limit(1)
+    ).scalar()
+
+
+def is_profile_pic(digest):
+    """Whether some user has the picture with this hash as their profile picture."""
+    return db.session.execute(
+        db.select(User.id).where(User.profile_pic_hash == digest).limit(1)
+    ).first() is not None
+
+
+def migrate_profile_pics(batch_size=100):
+    """
+    Move base64 pictures from the old user.profile_pic column into the blob store.
+
+    Rows are read a batch at a time by id, each picture is decoded and stored,
+    its hash recorded and the old value cleared. Values that do not decode are
+    left in place and reported.
+    """
+    if "profile_pic" not in {column["name"] for column in inspect(db.engine).get_columns("user")}:
+        return
+
+    legacy = db.Table(
+        "user", db.MetaData(),
+        db.Column("id", db.Integer), db.Column("profile_pic", db.Text), db.Column("profile_pic_hash", db.String(64))
+    )
+    last_id, moved = 0, 0
+    while True:
+        rows = db.session.execute(
+            db.select(legacy.c.id, legacy.c.profile_pic)
+            .where(legacy.c.id > last_id, legacy.c.profile_pic.isnot(None))
+            .order_by(legacy.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        for user_id, profile_pic in rows:
+            try:
+                image_bytes = base64.b64decode(profile_pic)
+            except ValueError:
+                print(f"Profile picture of user {user_id} is not valid base64, left in place")
+                continue
+            db.session.execute(
+                legacy.update().where(legacy.c.id == user_id)
+                .values(profile_pic_hash=blob_store.put(image_bytes), profile_pic=None)
+            )
+            moved += 1
+        last_id = rows[-1][0]
+        db.session.commit()
+
+    if moved:
+        print(f"Moved {moved} profile pictures to the blob store")
+
+
+def backfill_profile_pic_metadata(batch_size=100):
+    """Record metadata of profile pictures saved before it was detected on write."""
+    last_id = 0
+    while True:
+        users = (
+            User.query
+            .filter(User.id > last_id, User.profile_pic_hash.isnot(None), User.profile_pic_mime.is_(None))
+            .order_by(User.id).limit(batch_size).all()
+        )
+        if not users:
+            break
+        for user in users:
+            image_bytes = blob_store.get(user.profile_pic_hash)
+            if image_bytes is None:
+                print(f"Profile picture of user {user.id} is missing from the blob store")
+                continue
+            try:
+                set_profile_pic_metadata(user, image_bytes)
+            except Exception as e:
+                print(f"Profile picture of user {user.id} could not be read: {e}")
+        last_id = users[-1].id
+        db.session.commit()
@@ -12,8 +12,17 @@ class Config:
     #SQLALCHEMY_DATABASE_URI = "sqlite:///everkonnect.db"
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    CORS_EXPOSE_HEADERS = ["X-Next-Cursor", "ETag"]  # /matches pagination, /api/images revalidation
 
 
+    # Profile pictures, see core.blob_store
+    BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")  # "local", "cloudinary" or "package.module:Class"
+    BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH")  # local backend, defaults to instance/blobs
+    BLOB_STORE_FOLDER = os.getenv("BLOB_STORE_FOLDER", "blobs")  # cloudinary backend
+    IMAGE_MAX_AGE = int(os.getenv("IMAGE_MAX_AGE", 31536000))  # /api/images, blobs never change
+    THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))  # threads rendering thumbnails after uploads
+    THUMBNAIL_QUEUE = int(os.getenv("THUMBNAIL_QUEUE", 100))  # pictures waiting beyond this are rendered on first request
+
     MAIL_SERVER = 'smtp.zoho.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
@@ -21,6 +30,27 @@ class Config:
     MAIL_PASSWORD = os.getenv("PASSWORD_FOR_EMAIL")
     MAIL_DEFAULT_SENDER = os.getenv("USERNAME_FOR_EMAIL")
 
+    # Matching
+    MATCHES_TOP_K = int(os.getenv("MATCHES_TOP_K", 50))
+    MATCHES_MAX_K = int(os.getenv("MATCHES_MAX_K", 500))
+    MATCH_POOL_TTL = int(os.getenv("MATCH_POOL_TTL", 300))
+    MATCH_SCORING_MODE = os.getenv("MATCH_SCORING_MODE", "pool")  # "pool" (in memory) or "sql" (database side)
+    MATCH_RANKING_MODE = os.getenv("MATCH_RANKING_MODE", "one_way")  # default /matches mode, "one_way" or "reciprocal"
+    MATCH_STORE_K = int(os.getenv("MATCH_STORE_K", MATCHES_MAX_K))
+    MATCH_WEIGHTS = os.getenv("MATCH_WEIGHTS")  # JSON {"field": points}, unset fields 5; run flask upgrade-db after changing
+    MATCH_MAX_RADIUS_KM = float(os.getenv("MATCH_MAX_RADIUS_KM", 1000))
+    MATCH_BACKGROUND_UPDATES = os.getenv("MATCH_BACKGROUND_UPDATES", "true").lower() == "true"  # also run match jobs in a thread per web process; for a single web process, turn off and run `flask match-worker` with several
+    MATCH_JOB_BATCH = int(os.getenv("MATCH_JOB_BATCH", 100))
+    MATCH_JOB_LEASE = int(os.getenv("MATCH_JOB_LEASE", 300))  # seconds before a claimed job is given to another worker
+    MATCH_JOB_MAX_ATTEMPTS = int(os.getenv("MATCH_JOB_MAX_ATTEMPTS", 5))
+    MATCH_JOB_POLL = float(os.getenv("MATCH_JOB_POLL", 2))
+    MATCH_PARALLEL_WORKERS = int(os.getenv("MATCH_PARALLEL_WORKERS", 0))  # 0 or 1 scores in-process
+    MATCH_PARALLEL_MIN_POOL = int(os.getenv("MATCH_PARALLEL_MIN_POOL", 50000))
+    MATCH_CACHE_URL = os.getenv("MATCH_CACHE_URL")  # redis:// URL to share the cache between workers
+    MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", 10000))
+    MATCH_CACHE_TTL = int(os.getenv("MATCH_CACHE_TTL", 120))
+    SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 30))  # seconds a coalesced request waits before computing itself
+
 
 cloudinary.config(
     cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
@@ -0,0 +1,100 @@
+import csv
+import math
+import os
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+
+# Offline place lookup for the free-text current_location field, plus the grid
+# used to bucket coordinates. core/data/gazetteer.csv lists cities (with
+# aliases) and countries; a country alone gives a region but no coordinates.
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), "data", "gazetteer.csv")
+CELL_DEGREES = 1.0  # grid cell size, about 111 km north to south
+EARTH_RADIUS_KM = 6371.0
+
+_ROWS = int(180 / CELL_DEGREES)
+_COLUMNS = int(360 / CELL_DEGREES)
+
+# Where to look for matches: a radius around a point, a region (country code), or both
+Area = namedtuple("Area", "latitude longitude radius_km region")
+
+
+def _key(name):
+    return " ".join(name.lower().replace(".", "").split())
+
+
+@lru_cache(maxsize=1)
+def _gazetteer():
+    places = {}
+    with open(GAZETTEER_PATH, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row["latitude"]:
+                place = (row["country"], float(row["latitude"]), float(row["longitude"]))
+            else:
+                place = (row["country"], None, None)
+            for name in [row["name"]] + [alias for alias in row["aliases"].split("|") if alias]:
+                places.setdefault(_key(name), place)
+    return places
+
+
+def resolve_location(text):
+    """
+    Return (region, latitude, longitude) for a location such as "Lagos" or "Toronto, Canada".
+
+    A bare country gives its region with no coordinates, an unknown place gives all None.
+    """
+    parts = [_key(part) for part in (text or "").split(",")]
+    parts = [part for part in parts if part]
+    if not parts:
+        return None, None, None
+
+    places = _gazetteer()
+    full = " ".join(parts)
+    if full in places:
+        return places[full]
+
+    # "City, Country": the most specific part that is known wins
+    known = [places[part] for part in parts if part in places]
+    for place in known:
+        if place[1] is not None:
+            return place
+    return known[0] if known else (None, None, None)
+
+
+def grid_cell(latitude, longitude):
+    """Integer id of the grid cell holding a point."""
+    row = min(int((latitude + 90) // CELL_DEGREES), _ROWS - 1)
+    column = int((longitude + 180) // CELL_DEGREES) % _COLUMNS
+    return row * _COLUMNS + column
+
+
+def cells_within(latitude, longitude, radius_km):
+    """Ids of the grid cells covering a circle's bounding box."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    low_row = max(int((latitude - lat_delta + 90) // CELL_DEGREES), 0)
+    high_row = min(int((latitude + lat_delta + 90) // CELL_DEGREES), _ROWS - 1)
+
+    # Longitude degrees shrink towards the poles; near one, take every column
+    widest = max(abs(latitude) + lat_delta, 0)
+    if widest >= 89:
+        columns = range(_COLUMNS)
+    else:
+        lon_delta = lat_delta / math.cos(math.radians(widest))
+        if lon_delta >= 180:
+            columns = range(_COLUMNS)
+        else:
+            low_column = int((longitude - lon_delta + 180) // CELL_DEGREES)
+            high_column = int((longitude + lon_delta + 180) // CELL_DEGREES)
+            columns = sorted({column % _COLUMNS for column in range(low_column, high_column + 1)})
+
+    return [row * _COLUMNS + column for row in range(low_row, high_row + 1) for column in columns]
+
+
+def distance_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance from one point to each of the given points (NumPy arrays or floats)."""
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
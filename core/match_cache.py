@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from core.imports import json, time, threading
+from core.models import User, LoveBasicInfo, UserPersonality, MatchPreference, MatchScore, Connection, Message
+from core.match_exclusions import already_excluded
+
+
+# Ranked /matches responses per user. Entries are dropped when a commit touches
+# something that can change the list: the user's own preferences, a candidate
+# already in it, or a connection or message that excludes someone. Lists a
+# candidate newly enters are reported by core.match_store through
+# session.info["match_lists_changed"].
+
+
+class LocalMatchCache:
+    """In-process LRU of user_id -> {limit: matches}, each entry living at most `ttl` seconds."""
+
+    def __init__(self, max_users=10000, ttl=120):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, limit):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["created"] > self.ttl:
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return entry["lists"].get(limit)
+
+    def set(self, user_id, limit, matches):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or time.monotonic() - entry["created"] > self.ttl:
+                entry = self.entries[user_id] = {"created": time.monotonic(), "lists": {}}
+            entry["lists"][limit] = matches
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+
+class RedisMatchCache:
+    """Shared cache for several app workers, one hash per user. Needs the redis package."""
+
+    def __init__(self, url, ttl=120):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, user_id, limit):
+        value = self.client.hget(f"matches:{user_id}", limit)
+        return json.loads(value) if value is not None else None
+
+    def set(self, user_id, limit, matches):
+        key = f"matches:{user_id}"
+        pipe = self.client.pipeline()
+        pipe.hset(key, limit, json.dumps(matches))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def delete(self, user_ids):
+        keys = [f"matches:{user_id}" for user_id in user_ids]
+        if keys:
+            self.client.delete(*keys)
+
+
+class MatchCache:
+    """Per-user match pages and rankings, kept in process or in Redis when MATCH_CACHE_URL is set."""
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        ttl = app.config.get("MATCH_CACHE_TTL", 120)
+        if app.config.get("MATCH_CACHE_URL"):
+            self.backend = RedisMatchCache(app.config["MATCH_CACHE_URL"], ttl)
+        else:
+            self.backend = LocalMatchCache(app.config.get("MATCH_CACHE_SIZE", 10000), ttl)
+
+    def get(self, user_id, limit):
+        return self.backend.get(int(user_id), limit) if self.backend else None
+
+    def set(self, user_id, limit, matches):
+        if self.backend:
+            self.backend.set(int(user_id), limit, matches)
+
+    def invalidate(self, user_ids):
+        if self.backend and user_ids:
+            self.backend.delete({int(user_id) for user_id in user_ids})
+
+
+match_cache = MatchCache()
+
+
+def mark_lists_changed(session, user_ids):
+    """Drop these users' cached lists once the session commits."""
+    session.info.setdefault("match_lists_changed", set()).update(user_ids)
+
+
+def _user_list_changed(session, user):
+    if user in session.deleted:
+        return True
+    attrs = inspect(user).attrs
+    return attrs.profile_pic_hash.history.has_changes() or attrs.account_type.history.has_changes()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_lists(session, flush_context):
+    owners, candidates = set(), set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, MatchPreference):
+            owners.add(obj.user_id)
+        elif isinstance(obj, (LoveBasicInfo, UserPersonality)):
+            # Their own reciprocal and radius rankings use their profile too
+            owners.add(obj.user_id)
+            candidates.add(obj.user_id)
+        elif isinstance(obj, User) and _user_list_changed(session, obj):
+            owners.add(obj.id)
+            candidates.add(obj.id)
+        elif isinstance(obj, (Connection, Message)) and obj not in session.dirty:
+            # A new connection or thread takes each side out of the other's matches,
+            # later messages between a pair already left out change nothing
+            if obj in session.deleted or not already_excluded(obj.sender_id, obj.receiver_id):
+                owners.update((obj.sender_id, obj.receiver_id))
+
+    # Lists already holding a changed candidate show its old score, nickname or picture
+    candidates.discard(None)
+    if candidates:
+        lists = session.query(MatchScore.signature).filter(MatchScore.candidate_id.in_(candidates))
+        holders = session.query(MatchPreference.user_id).filter(MatchPreference.signature.in_(lists.scalar_subquery()))
+        owners.update(user_id for user_id, in holders)
+    mark_lists_changed(session, owners)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_lists(session):
+    match_cache.invalidate(session.info.pop("match_lists_changed", set()) - {None})
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changed_lists(session, previous_transaction):
+    # Only the outermost rollback drops them, a savepoint rolling back leaves the enclosing changes pending
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop("match_lists_changed", None)
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from itertools import chain
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from core.imports import time, threading
+from core.extensions import db
+from core.models import Connection, Message
+
+
+# People a user already has a connection with (in any state) or a message
+# thread with are left out of their matches. Each user's set is read from the
+# connection and message tables on first use, then kept current by the commit
+# hooks below. Sets live at most MATCH_POOL_TTL seconds so writes made by other
+# workers are picked up.
+
+_sets = OrderedDict()
+_sets_lock = threading.Lock()
+
+
+def _load_exclusions(user_id):
+    excluded = set()
+    for model in (Connection, Message):
+        excluded.update(other for other, in db.session.query(model.receiver_id).filter(model.sender_id == user_id).distinct())
+        excluded.update(other for other, in db.session.query(model.sender_id).filter(model.receiver_id == user_id).distinct())
+    return excluded
+
+
+def get_exclusions(user_id):
+    """Ids the user has connected with or messaged, as a set shared with the cache (do not modify)."""
+    user_id = int(user_id)
+    ttl = current_app.config.get("MATCH_POOL_TTL", 300)
+    with _sets_lock:
+        entry = _sets.get(user_id)
+        if entry and time.monotonic() - entry[0] < ttl:
+            _sets.move_to_end(user_id)
+            return entry[1]
+
+    excluded = _load_exclusions(user_id)
+    with _sets_lock:
+        _sets[user_id] = (time.monotonic(), excluded)
+        while len(_sets) > current_app.config.get("MATCH_CACHE_SIZE", 10000):
+            _sets.popitem(last=False)
+    return excluded
+
+
+def already_excluded(a, b):
+    """Whether a loaded exclusion set already links the pair. False when neither user's set is loaded."""
+    with _sets_lock:
+        for user_id, other in ((a, b), (b, a)):
+            entry = _sets.get(user_id)
+            if entry and other in entry[1]:
+                return True
+    return False
+
+
+def _add_pair(a, b):
+    with _sets_lock:
+        for user_id, other in ((a, b), (b, a)):
+            entry = _sets.get(user_id)
+            if entry:
+                # Copied so a reader holding the old set never sees it change
+                _sets[user_id] = (entry[0], entry[1] | {other})
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_pairs(session, flush_context):
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, (Connection, Message)):
+            if obj in session.new:
+                # Every message after the first in a thread changes nothing
+                if not already_excluded(obj.sender_id, obj.receiver_id):
+                    session.info.setdefault("exclusions_added", set()).add((obj.sender_id, obj.receiver_id))
+            else:
+                session.info.setdefault("exclusions_dropped", set()).add((obj.sender_id, obj.receiver_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pairs(session):
+    for a, b in session.info.pop("exclusions_added", ()):
+        _add_pair(a, b)
+
+    # Another connection or message may still link the pair, so reload those users
+    dropped = session.info.pop("exclusions_dropped", ())
+    with _sets_lock:
+        for user_id in chain.from_iterable(dropped):
+            _sets.pop(user_id, None)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_pairs(session, previous_transaction):
+    if previous_transaction.parent is not None:
+        # Pairs added inside the savepoint may be gone, have those users reloaded instead
+        added = session.info.pop("exclusions_added", None)
+        if added:
+            session.info.setdefault("exclusions_dropped", set()).update(added)
+        return
+    session.info.pop("exclusions_added", None)
+    session.info.pop("exclusions_dropped", None)
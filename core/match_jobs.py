@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta
+import socket
+from flask import current_app
+from sqlalchemy import event, case
+from sqlalchemy.orm import Session
+from core.imports import os, threading, or_
+from core.extensions import db
+from core.savepoint import try_insert
+from core.models import MatchJob, MatchScore
+from core.matching import reset_match_pools
+from core.match_store import update_match_column, update_match_row, rebuild_match_list, stored_signatures
+
+
+# Match list updates are queued in the match_jobs table in the same
+# transaction as the write that needs them, so a committed profile change
+# always has its job. `flask match-worker` claims due jobs a batch at a time
+# under a lease (a crashed worker's jobs are picked up again once it runs
+# out) and deletes each one when done. A job queued again while pending is
+# not duplicated, its `requests` count is bumped instead, and a run only
+# deletes the job if nobody queued it again meanwhile. With
+# MATCH_BACKGROUND_UPDATES on, each web process also drains the queue from a
+# thread, which suits a single web process: its pools already follow its own
+# writes. Each job records the process that queued it, and once a thread
+# claims one queued elsewhere it knows other processes write too and reloads
+# its pools before every batch from then on. With several web processes,
+# turn MATCH_BACKGROUND_UPDATES off and run `flask match-worker` instead.
+
+def _process():
+    # Host and pid, recomputed per call since web servers fork after import
+    return f"{socket.gethostname()}:{os.getpid()}"[:80]
+
+
+def _job_key(kind, user_id=None, account_type=None, signature=None):
+    if kind == "user":
+        return f"user:{int(user_id)}"
+    if kind == "signature":
+        return f"signature:{account_type}:{signature}"
+    if kind == "rebuild":
+        return f"rebuild:{account_type or '*'}"
+    raise ValueError(f"Unknown match job kind: {kind}")
+
+
+def enqueue_match_job(kind, user_id=None, account_type=None, signature=None):
+    """
+    Queue a match job in the current transaction, it is picked up once that commits.
+
+    kind is "user" (after a profile or preference write), "signature" (recompute
+    one stored list) or "rebuild" (every list of an account type, or all of them).
+    """
+    key = _job_key(kind, user_id, account_type, signature)
+    process = _process()
+    bump = {
+        "requests": MatchJob.requests + 1, "attempts": 0, "last_error": None,
+        # A job queued by several processes belongs to none of them
+        "queued_by": case((MatchJob.queued_by == process, process), else_=None),
+    }
+    # The caller's own pending writes are flushed first, so their errors reach the caller
+    db.session.flush()
+    if not MatchJob.query.filter_by(key=key).update(bump, synchronize_session=False):
+        job = MatchJob(
+            key=key, kind=kind, user_id=user_id, account_type=account_type, signature=signature,
+            requests=1, attempts=0, queued_by=process
+        )
+        if not try_insert(db.session, lambda: db.session.add(job)):
+            MatchJob.query.filter_by(key=key).update(bump, synchronize_session=False)
+    db.session.info["match_jobs_queued"] = True
+
+    if current_app.config.get("MATCH_BACKGROUND_UPDATES", True):
+        _start_thread(current_app._get_current_object())
+
+
+def _run_job(kind, user_id, account_type, signature):
+    if kind == "user":
+        for list_account_type, list_signature in update_match_column(user_id):
+            enqueue_match_job("signature", account_type=list_account_type, signature=list_signature)
+        db.session.commit()
+        update_match_row(user_id)
+    elif kind == "signature":
+        rebuild_match_list(account_type, signature)
+    elif kind == "rebuild":
+        # Lists are dropped now and recomputed one signature job at a time
+        lists = MatchScore.query
+        if account_type:
+            lists = lists.filter_by(account_type=account_type)
+        lists.delete(synchronize_session=False)
+        for list_account_type, list_signature in stored_signatures(account_type):
+            enqueue_match_job("signature", account_type=list_account_type, signature=list_signature)
+        db.session.commit()
+
+
+def run_match_jobs(batch_size=None, reset_pools=False):
+    """
+    Claim one batch of due jobs, oldest first, and run them. Returns how many were claimed.
+
+    reset_pools reloads the match pools before the batch, for a process that
+    does not see the writes behind its jobs (`flask match-worker`). A web
+    process's pools are already invalidated by its own commits, so its thread
+    only reloads them once it has claimed a job queued by another process.
+    """
+    global _shared_queue
+    config = current_app.config
+    batch_size = batch_size or config.get("MATCH_JOB_BATCH", 100)
+    now = datetime.utcnow()
+
+    # 1. Claim: jobs that are not leased and have retries left
+    jobs = (
+        MatchJob.query
+        .filter(or_(MatchJob.claimed_until.is_(None), MatchJob.claimed_until < now))
+        .filter(MatchJob.attempts < config.get("MATCH_JOB_MAX_ATTEMPTS", 5))
+        .order_by(MatchJob.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    claimed = [(job.id, job.kind, job.user_id, job.account_type, job.signature, job.requests) for job in jobs]
+    process = _process()
+    foreign = any(job.queued_by != process for job in jobs)
+    lease = now + timedelta(seconds=config.get("MATCH_JOB_LEASE", 300))
+    for job in jobs:
+        job.claimed_until = lease
+    db.session.commit()
+    if not claimed:
+        return 0
+
+    # 2. Pools predate the writes made by other processes, load them once for the batch
+    if foreign and not reset_pools and not _shared_queue:
+        current_app.logger.warning(
+            "Match jobs are queued by several processes, reloading the match pools before every batch; "
+            "set MATCH_BACKGROUND_UPDATES=false and run `flask match-worker` instead"
+        )
+    _shared_queue = _shared_queue or foreign
+    if reset_pools or _shared_queue:
+        reset_match_pools()
+
+    for job_id, kind, user_id, account_type, signature, requests in claimed:
+        try:
+            _run_job(kind, user_id, account_type, signature)
+            done = MatchJob.query.filter_by(id=job_id, requests=requests).delete(synchronize_session=False)
+            if not done:
+                # Queued again while running, run it once more
+                MatchJob.query.filter_by(id=job_id).update({"claimed_until": None}, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            MatchJob.query.filter_by(id=job_id).update({
+                "attempts": MatchJob.attempts + 1, "claimed_until": None, "last_error": str(e)[:2000]
+            }, synchronize_session=False)
+            db.session.commit()
+            current_app.logger.warning(
+                "Match job %s %s failed: %s", kind, user_id or signature or account_type or "", e
+            )
+    return len(claimed)
+
+
+_shared_queue = False  # set once this process has claimed a job another process queued
+_wake = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def work(once=False, stop=None, reset_pools=False):
+    """Run jobs until `stop` is set, or until the queue is empty with once=True."""
+    poll = current_app.config.get("MATCH_JOB_POLL", 2)
+    while not (stop and stop.is_set()):
+        try:
+            claimed = run_match_jobs(reset_pools=reset_pools)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception("Match job batch failed: %s", e)
+            claimed = 0
+        if claimed:
+            continue
+        if once:
+            return
+        _wake.wait(poll)
+        _wake.clear()
+
+
+def _run_thread(app):
+    with app.app_context():
+        work()
+
+
+def _start_thread(app):
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run_thread, args=(app,), name="match-job-worker", daemon=True)
+            _thread.start()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_worker(session):
+    if session.info.pop("match_jobs_queued", False):
+        _wake.set()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_queued(session, previous_transaction):
+    # Only the outermost rollback drops them, a savepoint rolling back leaves the enclosing jobs queued
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop("match_jobs_queued", None)
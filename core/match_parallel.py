@@ -0,0 +1,175 @@
+import heapq
+import sys
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, resource_tracker, shared_memory
+import numpy as np
+from flask import current_app
+
+
+# Optional multi-core scoring for large match pools.
+# A pool's arrays are copied into shared memory once and workers attach to them
+# by name, so a task only carries the encoded preference and its row range.
+# Workers are spawned, not forked, so they never inherit DB connections or locks,
+# and they import this module, so it stays clear of core.imports and the models.
+
+
+class SharedPool:
+    """A MatchPool's scoring arrays in shared memory, described by (name, shape, dtype) specs."""
+
+    def __init__(self, pool):
+        self.segments = []
+        self.user_ids = self._share(pool.user_ids)
+        self.codes = self._share(pool.codes)
+        self.birth_years = self._share(pool.birth_years)
+        self.lists = [(self._share(postings.offsets), self._share(postings.rows)) for postings in pool.lists]
+        weakref.finalize(self, _release, self.segments)
+
+    def _share(self, array):
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        self.segments.append(segment)
+        return segment.name, array.shape, array.dtype.str
+
+
+def _release(segments):
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def top_k(pool, preferences, k, exclude_user_ids=()):
+    """Same result as pool.top_k, sharded across worker processes for pools above MATCH_PARALLEL_MIN_POOL."""
+    workers = current_app.config.get("MATCH_PARALLEL_WORKERS", 0)
+    if workers < 2 or len(pool) < current_app.config.get("MATCH_PARALLEL_MIN_POOL", 50000):
+        return pool.top_k(preferences, k, exclude_user_ids)
+
+    shared = getattr(pool, "shared", None)
+    if shared is None:
+        shared = pool.shared = SharedPool(pool)
+
+    from core.matching import age_limits, birth_year_bounds, get_scoring_plan  # parent side only, workers never import the models
+
+    plan = get_scoring_plan()
+    pref_codes = pool._preference_codes(preferences)
+    birth_years = birth_year_bounds(*age_limits(preferences))
+    terms = [
+        (j, pool.lists[j].token_ids(pref_set), pref_size, weight)
+        for j, pref_set, pref_size, weight in pool._list_terms(preferences, plan)
+    ]
+    excluded = [pool.row_of[int(uid)] for uid in exclude_user_ids if int(uid) in pool.row_of]
+    bounds = np.linspace(0, len(pool), workers + 1, dtype=np.int64)
+
+    try:
+        executor = _get_executor(workers)
+        futures = [
+            executor.submit(
+                _score_shard, shared.user_ids, shared.codes, shared.lists, shared.birth_years,
+                int(start), int(stop), pref_codes, terms, birth_years, excluded, k, plan.exact_weights
+            )
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+        ]
+        shards = [future.result() for future in futures]
+    except BrokenProcessPool:
+        _reset_executor()
+        return pool.top_k(preferences, k, exclude_user_ids)
+
+    best = heapq.nlargest(k, (entry for shard in shards for entry in shard))
+    return [(row, score) for score, _, row in best]
+
+
+# --- Worker side ---
+
+_attached = {}
+
+
+def _attach(name):
+    """Open a segment the parent created without registering it with the resource tracker."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Before 3.13 attaching always registers, and the tracker then reports the
+    # parent's segment as leaked, or unlinks it, when this worker exits. The
+    # parent owns the segment and unlinks it itself.
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _view(spec):
+    name, shape, dtype = spec
+    segment = _attached.get(name)
+    if segment is None:
+        # Old pools are unlinked by the parent, drop their handles now and then
+        if len(_attached) > 64:
+            for stale in _attached.values():
+                stale.close()
+            _attached.clear()
+        segment = _attached[name] = _attach(name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+def _score_shard(user_ids_spec, codes_spec, list_specs, birth_years_spec, start, stop,
+                 pref_codes, terms, birth_years, excluded, k, exact_weights):
+    """Score rows [start, stop) and return the shard's best k as (score, -user_id, row)."""
+    user_ids = _view(user_ids_spec)[start:stop]
+    codes = _view(codes_spec)[start:stop]
+
+    scores = ((codes == pref_codes) @ exact_weights).astype(np.float64)
+    for field_index, token_ids, pref_size, weight in terms:
+        offsets_spec, rows_spec = list_specs[field_index]
+        offsets, rows = _view(offsets_spec), _view(rows_spec)
+        # Each token's rows are sorted, so the shard's part of them is one slice
+        shard_rows = [
+            token_rows[np.searchsorted(token_rows, start):np.searchsorted(token_rows, stop)]
+            for token_rows in (rows[offsets[t]:offsets[t + 1]] for t in token_ids)
+        ]
+        hits = np.concatenate(shard_rows) if shard_rows else np.zeros(0, dtype=np.int64)
+        overlap = np.bincount(hits - start, minlength=stop - start)
+        scores += (overlap / pref_size) * weight
+
+    # Same age range rule as MatchPool.rows_in_age, unknown birth years (0) pass
+    earliest, latest = birth_years
+    if earliest is not None or latest is not None:
+        years = _view(birth_years_spec)[start:stop]
+        outside = np.zeros(len(years), dtype=bool)
+        if earliest is not None:
+            outside |= years < earliest
+        if latest is not None:
+            outside |= years > latest
+        scores[outside & (years != 0)] = 0
+
+    rows = np.flatnonzero(scores > 0)
+    if excluded:
+        rows = rows[~np.isin(rows + start, excluded)]
+    truncated = scores[rows].astype(np.int64)
+    order = np.lexsort((user_ids[rows], -truncated))[:k]
+
+    return [
+        (int(truncated[i]), -int(user_ids[rows[i]]), int(rows[i]) + start)
+        for i in order
+    ]
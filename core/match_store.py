@@ -0,0 +1,372 @@
+from bisect import bisect_right
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from core.extensions import db
+from core.models import User, LoveBasicInfo, MatchPreference, MatchScore, MatchWeight
+from core.matching import (
+    FIELD_WEIGHT, get_match_pool, get_preference_pool, get_scoring_plan, preference_signature, profile_values,
+    reciprocal_top_k, sql_top_k
+)
+from core import match_parallel
+from core.match_cache import match_cache, mark_lists_changed
+from core.match_exclusions import get_exclusions
+from core.single_flight import single_flight
+
+
+# Users with the same preference signature share one stored list in
+# signature_match_scores, holding the best MATCH_STORE_K + 1 candidates so a
+# user found in their own list can be skipped at read time and still leave K.
+# A profile write changes one column (every list's score for that candidate),
+# and queues a recompute of the full lists the candidate fell out of; a
+# preference write at most adds the list for a signature nobody had yet. The
+# list of a signature nobody has anymore is dropped by a "signature" job queued
+# by the write that left it behind.
+
+
+def compute_top_matches(preferences, account_type, exclude_user_ids=(), k=None, area=None):
+    """Best k (default MATCH_STORE_K + 1) (candidate_id, score) pairs, scored in the app or in the database per MATCH_SCORING_MODE."""
+    k = k or current_app.config["MATCH_STORE_K"] + 1
+    if current_app.config.get("MATCH_SCORING_MODE") == "sql":
+        return sql_top_k(preferences, account_type, k, exclude_user_ids, area)
+
+    pool = get_match_pool(account_type)
+    if area is not None:
+        # An area keeps the candidate set local, not worth sharding
+        top = pool.top_k(preferences, k, exclude_user_ids, area)
+    else:
+        top = match_parallel.top_k(pool, preferences, k, exclude_user_ids)
+    return [(int(pool.user_ids[row]), score) for row, score in top]
+
+
+def _list_owners(signatures):
+    """Users whose preferences have one of the given signatures."""
+    signatures = list(signatures)
+    owners = []
+    for start in range(0, len(signatures), 500):
+        owners += [
+            user_id for user_id, in
+            db.session.query(MatchPreference.user_id).filter(MatchPreference.signature.in_(signatures[start:start + 500]))
+        ]
+    return owners
+
+
+def update_match_row(user_id):
+    """
+    Make sure the list for a user's preference signature exists.
+
+    It is only computed when no other user has the same preferences yet.
+    """
+    user_id = int(user_id)
+    mark_lists_changed(db.session, [user_id])
+
+    preferences = MatchPreference.query.filter_by(user_id=user_id).first()
+    account_type = db.session.query(User.account_type).filter_by(id=user_id).scalar()
+    if preferences and account_type:
+        signature = preference_signature(preferences)
+        stored = db.session.query(
+            MatchScore.query.filter_by(account_type=account_type, signature=signature).exists()
+        ).scalar()
+        if not stored:
+            db.session.bulk_insert_mappings(MatchScore, [
+                {"account_type": account_type, "signature": signature, "candidate_id": candidate_id, "score": score}
+                for candidate_id, score in compute_top_matches(preferences, account_type)
+            ])
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process stored the same signature's list first
+        db.session.rollback()
+
+
+def update_match_column(candidate_id):
+    """
+    Rescore one candidate against every stored preference signature and update the lists it belongs in.
+
+    Only lists the candidate was in or scores in are looked at. Lists that were
+    never computed are left alone, they are filled on first read. A list holds
+    either its best MATCH_STORE_K + 1 candidates or, when shorter, every
+    candidate that scores at all; a candidate dropping out of a full list leaves
+    a place that only a recompute can fill, so those lists are returned as
+    (account_type, signature) pairs for the caller to queue.
+    """
+    candidate_id = int(candidate_id)
+    held = dict(db.session.query(MatchScore.signature, MatchScore.score).filter_by(candidate_id=candidate_id))
+    mark_lists_changed(db.session, _list_owners(held))
+    MatchScore.query.filter_by(candidate_id=candidate_id).delete(synchronize_session=False)
+
+    refill = []
+    user = User.query.get(candidate_id)
+    account_type = user.account_type if user else None
+    candidate_scores = {}
+    if user and account_type and user.love_basic_info and user.personality:
+        prefs = get_preference_pool(account_type)
+        scores = prefs.score_signatures(profile_values(user.love_basic_info, user.personality))
+        candidate_scores = {
+            signature: int(score) for signature, score in zip(prefs.signatures.tolist(), scores.tolist()) if score > 0
+        }
+
+    if account_type:
+        store_k = current_app.config["MATCH_STORE_K"] + 1
+        # Bounds of the other entries, the candidate's own rows are already gone
+        stored = _list_bounds(account_type, set(candidate_scores) | set(held))
+        new_rows, full_lists = [], []
+        for signature, (count, floor) in stored.items():
+            score = candidate_scores.get(signature)
+            old_score = held.get(signature)
+            if old_score is not None and count + 1 >= store_k:
+                # Everyone outside a full list scores at most min(old_score, floor)
+                stays = score is not None and (score >= old_score or score > floor)
+                if not stays:
+                    refill.append((account_type, signature))
+                    continue
+            elif score is None or (count >= store_k and score < floor):
+                continue
+            new_rows.append({"account_type": account_type, "signature": signature, "candidate_id": candidate_id, "score": score})
+            if old_score is None and count >= store_k:
+                full_lists.append(signature)
+
+        db.session.bulk_insert_mappings(MatchScore, new_rows)
+        mark_lists_changed(db.session, _list_owners(row["signature"] for row in new_rows))
+        _trim_match_lists(account_type, full_lists, store_k)
+
+    db.session.commit()
+    return refill
+
+
+def rebuild_match_list(account_type, signature):
+    """Recompute the stored list of one preference signature, or drop it when no preference has it anymore."""
+    preferences = (
+        MatchPreference.query.join(User, User.id == MatchPreference.user_id)
+        .filter(User.account_type == account_type, MatchPreference.signature == signature)
+        .first()
+    )
+    _drop_match_lists(account_type, [signature])
+    if preferences:
+        db.session.bulk_insert_mappings(MatchScore, [
+            {"account_type": account_type, "signature": signature, "candidate_id": candidate_id, "score": score}
+            for candidate_id, score in compute_top_matches(preferences, account_type)
+        ])
+    mark_lists_changed(db.session, _list_owners([signature]))
+    db.session.commit()
+
+
+def signature_in_use(signature):
+    """Whether any preference still has a signature."""
+    return db.session.query(MatchPreference.query.filter_by(signature=signature).exists()).scalar()
+
+
+def stored_signatures(account_type=None):
+    """(account_type, signature) of every preference set that has users, for a full rebuild."""
+    query = (
+        db.session.query(User.account_type, MatchPreference.signature)
+        .join(User, User.id == MatchPreference.user_id)
+        .filter(User.account_type.isnot(None), MatchPreference.signature.isnot(None))
+    )
+    if account_type:
+        query = query.filter(User.account_type == account_type)
+    return query.distinct().all()
+
+
+def _list_bounds(account_type, signatures):
+    """signature -> (size, lowest score) of the stored lists among the given signatures."""
+    signatures = list(signatures)
+    bounds = {}
+    for start in range(0, len(signatures), 500):
+        bounds.update(
+            (signature, (count, floor))
+            for signature, count, floor in db.session.query(
+                MatchScore.signature, db.func.count(MatchScore.id), db.func.min(MatchScore.score)
+            ).filter(
+                MatchScore.account_type == account_type, MatchScore.signature.in_(signatures[start:start + 500])
+            ).group_by(MatchScore.signature)
+        )
+    return bounds
+
+
+def _drop_match_lists(account_type, signatures):
+    signatures = list(signatures)
+    for start in range(0, len(signatures), 500):
+        MatchScore.query.filter(
+            MatchScore.account_type == account_type, MatchScore.signature.in_(signatures[start:start + 500])
+        ).delete(synchronize_session=False)
+
+
+def _trim_match_lists(account_type, signatures, keep):
+    """Drop everything past position `keep` in the given lists."""
+    for start in range(0, len(signatures), 500):
+        position = db.func.row_number().over(
+            partition_by=MatchScore.signature,
+            order_by=(MatchScore.score.desc(), MatchScore.candidate_id)
+        ).label("position")
+        ranked = (
+            db.session.query(MatchScore.id, position)
+            .filter(MatchScore.account_type == account_type, MatchScore.signature.in_(signatures[start:start + 500]))
+            .subquery()
+        )
+        overflow = db.select(ranked.c.id).where(ranked.c.position > keep)
+        MatchScore.query.filter(MatchScore.id.in_(overflow)).delete(synchronize_session=False)
+
+
+def apply_scoring_weights():
+    """
+    Drop the stored lists that the current MATCH_WEIGHTS would score differently.
+
+    Only lists whose preferences set a field with a changed weight are affected,
+    they are recomputed with the new weights on their next read. The weights are
+    then recorded in match_weights; databases from before that table count as
+    scored with FIELD_WEIGHT everywhere. Returns the changed fields.
+    """
+    weights = get_scoring_plan().weights
+    stored = dict(db.session.query(MatchWeight.field, MatchWeight.weight))
+    changed = sorted(field for field, weight in weights.items() if stored.get(field, FIELD_WEIGHT) != weight)
+    if not changed:
+        return []
+
+    uses_changed = db.or_(*[
+        db.and_(getattr(MatchPreference, field).isnot(None), getattr(MatchPreference, field) != "") for field in changed
+    ])
+    signatures = [signature for signature, in db.session.query(MatchPreference.signature).filter(uses_changed).distinct()]
+    for start in range(0, len(signatures), 500):
+        MatchScore.query.filter(MatchScore.signature.in_(signatures[start:start + 500])).delete(synchronize_session=False)
+    mark_lists_changed(db.session, _list_owners(signatures))
+
+    MatchWeight.query.delete()
+    db.session.add_all(MatchWeight(field=field, weight=weight) for field, weight in weights.items())
+    db.session.commit()
+    print(f"Match weights changed for {', '.join(changed)}: dropped the lists of {len(signatures)} preference sets")
+    return changed
+
+
+def get_stored_ranking(user_id, limit):
+    """
+    Read a user's best stored matches as (candidate_id, score) pairs.
+
+    The user and anyone in their exclusion set are skipped in the query. When
+    the ranking comes out short, a shared list shorter than MATCH_STORE_K + 1
+    is recomputed first in case candidates left it since, and a full one that
+    the exclusions leave short is scored afresh with those ids left out.
+    """
+    user_id = int(user_id)
+    preferences = MatchPreference.query.filter_by(user_id=user_id).first()
+    account_type = db.session.query(User.account_type).filter_by(id=user_id).scalar()
+    if not preferences or not account_type:
+        return []
+    signature = preference_signature(preferences)
+    excluded = get_exclusions(user_id) | {user_id}
+
+    def read():
+        return [
+            (candidate_id, score) for candidate_id, score in
+            db.session.query(MatchScore.candidate_id, MatchScore.score)
+            .filter(MatchScore.account_type == account_type, MatchScore.signature == signature)
+            .filter(MatchScore.candidate_id.notin_(excluded))
+            .order_by(MatchScore.score.desc(), MatchScore.candidate_id)
+            .limit(limit)
+        ]
+
+    ranking = read()
+    if not ranking:
+        # Users sharing the signature may all miss at once, the list is computed once
+        single_flight.do(("match_list", account_type, signature), lambda: update_match_row(user_id))
+        ranking = read()
+
+    if len(ranking) < limit:
+        store_k = current_app.config["MATCH_STORE_K"] + 1
+        stored = MatchScore.query.filter_by(account_type=account_type, signature=signature).count()
+        if stored < store_k:
+            stored = single_flight.do(
+                ("match_list", account_type, signature), lambda: _refill_match_list(preferences, account_type, signature, stored)
+            )
+            ranking = read()
+        if len(ranking) < limit and len(excluded) > 1 and stored >= store_k:
+            ranking = compute_top_matches(preferences, account_type, excluded, k=limit)
+    return ranking
+
+
+def _refill_match_list(preferences, account_type, signature, stored):
+    """Recompute a short stored list, written back only when the pool has more candidates for it. Returns its size."""
+    top = compute_top_matches(preferences, account_type)
+    if len(top) <= stored:
+        return stored
+    _drop_match_lists(account_type, [signature])
+    db.session.bulk_insert_mappings(MatchScore, [
+        {"account_type": account_type, "signature": signature, "candidate_id": candidate_id, "score": score}
+        for candidate_id, score in top
+    ])
+    mark_lists_changed(db.session, _list_owners([signature]))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process stored the same signature's list first
+        db.session.rollback()
+    return len(top)
+
+
+def get_reciprocal_ranking(user, limit, area=None):
+    """
+    Rank by fit in both directions (see reciprocal_top_k), as (candidate_id, score) pairs.
+
+    Computed on read from the pools rather than stored, since any candidate's
+    preference write can move it.
+    """
+    pool = get_match_pool(user.account_type)
+    prefs = get_preference_pool(user.account_type)
+    top = reciprocal_top_k(
+        pool, prefs, user.matchpreference,
+        profile_values(user.love_basic_info, user.personality), limit, get_exclusions(user.id) | {user.id}, area
+    )
+    return [(int(pool.user_ids[row]), score) for row, score in top]
+
+
+def get_match_ranking(user, mode, area=None):
+    """
+    A user's ranking for a /matches mode, up to MATCHES_MAX_K pairs.
+
+    The ranking is kept in match_cache next to the pages built from it, so later
+    pages are cut from the same snapshot and it is dropped with them. Rankings
+    limited to an Area are scored on read from the candidates inside it.
+    """
+    key = f"{mode}:ranking" if area is None else f"{mode}:ranking:{area.radius_km}:{area.region}"
+    ranking = match_cache.get(user.id, key)
+    if ranking is None:
+        # Pages of different sizes asked for together share one ranking
+        ranking = single_flight.do(("match_ranking", user.id, key), lambda: _compute_ranking(user, mode, area, key))
+    return ranking
+
+
+def _compute_ranking(user, mode, area, key):
+    limit = current_app.config["MATCHES_MAX_K"]
+    if mode == "reciprocal":
+        ranking = get_reciprocal_ranking(user, limit, area)
+    elif area is not None:
+        excluded = get_exclusions(user.id) | {user.id}
+        ranking = compute_top_matches(user.matchpreference, user.account_type, excluded, k=limit, area=area)
+    else:
+        ranking = get_stored_ranking(user.id, limit)
+    match_cache.set(user.id, key, ranking)
+    return ranking
+
+
+def page_after(ranking, after, limit):
+    """Up to `limit` pairs ranked below `after` (a (score, candidate_id) pair, or None for the top), and whether more follow."""
+    start = 0
+    if after is not None:
+        start = bisect_right(ranking, (-after[0], after[1]), key=lambda entry: (-entry[1], entry[0]))
+    return ranking[start:start + limit], start + limit < len(ranking)
+
+
+def match_details(matches):
+    """Turn (candidate_id, score) pairs into (candidate_id, score, nickname, profile_pic_hash) rows, keeping their order."""
+    candidate_ids = [candidate_id for candidate_id, _ in matches]
+    details = {
+        candidate_id: (nickname, profile_pic_hash)
+        for candidate_id, nickname, profile_pic_hash in db.session.query(LoveBasicInfo.user_id, LoveBasicInfo.nickname, User.profile_pic_hash)
+        .join(User, User.id == LoveBasicInfo.user_id)
+        .filter(LoveBasicInfo.user_id.in_(candidate_ids))
+    }
+    return [
+        (candidate_id, score) + details[candidate_id]
+        for candidate_id, score in matches
+        if candidate_id in details
+    ]
@@ -0,0 +1,873 @@
+import hashlib
+import heapq
+from flask import current_app
+from sqlalchemy import event, and_, inspect
+from sqlalchemy.orm import Session, object_session
+from core.imports import np, time, threading, json, re, date, or_
+from core.extensions import db
+from core.models import User, LoveBasicInfo, UserPersonality, MatchPreference
+from core.geo import resolve_location, grid_cell, cells_within, distance_km
+from core.traits import MODEL_TRAIT_FIELDS, trait_column, trait_value
+from core.single_flight import single_flight
+
+
+# Fields compared with ==, in the same order calculate_match_score checks them.
+# Picklist fields are compared by their trait_values id, see core.traits
+EXACT_FIELDS = [
+    (LoveBasicInfo, "age_range"),
+    (LoveBasicInfo, "marital_status"),
+    (LoveBasicInfo, "country_of_origin"),
+    (LoveBasicInfo, "tribe"),
+    (LoveBasicInfo, "skin_tone"),
+    (UserPersonality, "height"),
+    (UserPersonality, "eye_colour"),
+    (UserPersonality, "body_type"),
+    (UserPersonality, "hair_colour"),
+    (UserPersonality, "hair_style"),
+    (UserPersonality, "religion"),
+    (UserPersonality, "education"),
+    (UserPersonality, "languages"),
+]
+
+# Comma-separated fields scored by overlap, in calculate_match_score order
+LIST_FIELDS = ["interest", "hobbies", "movies", "music", "activities", "values", "personality"]
+
+FIELD_WEIGHT = 5  # points per field unless MATCH_WEIGHTS says otherwise
+
+# Codes that can never be equal to a stored value
+MISSING_VALUE = -1
+UNKNOWN_PREFERENCE = -2
+
+
+def derived_columns(model):
+    """Columns of a profile model that its write listeners fill in, never to be taken from a request."""
+    derived = {
+        LoveBasicInfo: {"birth_year", "region", "latitude", "longitude", "geo_cell"},
+        UserPersonality: {"trait_tokens"},
+        MatchPreference: {"trait_tokens", "signature", "age_min", "age_max"},
+    }.get(model, set())
+    return derived | {f"{field}_id" for field in MODEL_TRAIT_FIELDS.get(model, ())}
+
+
+def split_traits(value):
+    """Split a comma-separated trait string into a set of lower-cased tokens."""
+    if not value:
+        return set()
+    return {s.strip().lower() for s in value.split(',') if s.strip()}
+
+
+def normalize_trait_tokens(mapper, connection, target):
+    """
+    Store the parsed list fields of a UserPersonality/MatchPreference row alongside the text.
+
+    Only the fields changed since the row was loaded are parsed again, so an
+    update does not load the deferred list columns it did not touch. New rows,
+    rows not yet normalized and rows whose trait_tokens were set directly get
+    every field, the tokens only ever come from the text.
+    """
+    state = inspect(target)
+    stored = target.trait_tokens
+    if stored is None or state.key is None or state.attrs.trait_tokens.history.has_changes():
+        stored, fields = None, LIST_FIELDS
+    else:
+        fields = [field for field in LIST_FIELDS if state.attrs[field].history.has_changes()]
+    if not fields:
+        return
+    # A new dict, the JSON column does not notice changes made in place
+    tokens = dict(stored or {})
+    tokens.update({field: sorted(split_traits(getattr(target, field))) for field in fields})
+    target.trait_tokens = tokens
+
+
+def trait_tokens(row):
+    """Token sets of a row's list fields, parsed from the text only for rows not yet normalized."""
+    if row is None:
+        return {field: set() for field in LIST_FIELDS}
+    stored = row.trait_tokens
+    if stored is None:
+        return {field: split_traits(getattr(row, field)) for field in LIST_FIELDS}
+    return {field: set(stored.get(field, ())) for field in LIST_FIELDS}
+
+
+def _signature(exact_values, token_sets):
+    payload = json.dumps([[value or None for value in exact_values], [sorted(token_sets.get(field, ())) for field in LIST_FIELDS]])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def preference_signature(preferences):
+    """
+    Hash of everything calculate_match_score reads from a MatchPreference.
+
+    Preferences with the same signature rank every candidate the same way, so
+    they share one stored match list.
+    """
+    if getattr(preferences, "signature", None):
+        return preferences.signature
+    return _signature([getattr(preferences, field) for _, field in EXACT_FIELDS], trait_tokens(preferences))
+
+
+def set_preference_signature(mapper, connection, target):
+    target.signature = _signature([getattr(target, field) for _, field in EXACT_FIELDS], trait_tokens(target))
+
+
+_UPPER_BOUND = re.compile(r"<|\bunder\b|\bbelow\b|\bup to\b|\bor (?:less|younger)\b|\bmax", re.I)
+_LOWER_BOUND = re.compile(r"\+|>|\bover\b|\babove\b|\bor (?:more|older)\b|\bmin", re.I)
+
+
+def parse_age_range(value):
+    """
+    (min, max) ages of a range such as "25-35", "30+", "Under 30" or "25",
+    None for an open end.
+    """
+    numbers = [int(n) for n in re.findall(r"\d+", value or "")]
+    if not numbers:
+        return None, None
+    if len(numbers) == 1:
+        if _UPPER_BOUND.search(value):
+            return None, numbers[0]
+        if _LOWER_BOUND.search(value):
+            return numbers[0], None
+        return numbers[0], numbers[0]
+    return min(numbers[:2]), max(numbers[:2])
+
+
+def age_limits(preferences):
+    """A MatchPreference's (age_min, age_max), parsed from the text for rows not yet normalized."""
+    if preferences.age_min is None and preferences.age_max is None:
+        return parse_age_range(preferences.age_range)
+    return preferences.age_min, preferences.age_max
+
+
+def birth_year_bounds(age_min, age_max):
+    """Earliest and latest birth year of someone who can be age_min..age_max this year, None for an open end."""
+    year = date.today().year
+    earliest = year - age_max - 1 if age_max is not None else None
+    latest = year - age_min if age_min is not None else None
+    return earliest, latest
+
+
+def set_birth_year(mapper, connection, target):
+    target.birth_year = getattr(target.date_of_birth, "year", None)
+
+
+def set_age_limits(mapper, connection, target):
+    target.age_min, target.age_max = parse_age_range(target.age_range)
+
+
+def set_location(mapper, connection, target):
+    target.region, target.latitude, target.longitude = resolve_location(target.current_location)
+    target.geo_cell = grid_cell(target.latitude, target.longitude) if target.latitude is not None else None
+
+
+class ScoringPlan:
+    """
+    Points per scored field, compiled once from MATCH_WEIGHTS into the forms the scorers use.
+
+    Weights are whole points so the vectorized sums stay exact. A field weighted
+    0 is not scored at all.
+    """
+
+    def __init__(self, weights=None):
+        weights = dict(weights or {})
+        fields = [field for _, field in EXACT_FIELDS] + LIST_FIELDS
+        unknown = set(weights) - set(fields)
+        if unknown:
+            raise ValueError(f"Unknown MATCH_WEIGHTS fields: {', '.join(sorted(unknown))}")
+        for field, weight in weights.items():
+            if not isinstance(weight, int) or isinstance(weight, bool) or weight < 0:
+                raise ValueError(f"MATCH_WEIGHTS[{field!r}] must be a whole number of points, got {weight!r}")
+
+        self.weights = {field: weights.get(field, FIELD_WEIGHT) for field in fields}
+        self.exact_weights = np.array([self.weights[field] for _, field in EXACT_FIELDS], dtype=np.int64)
+        self.list_weights = np.array([self.weights[field] for field in LIST_FIELDS], dtype=np.int64)
+        # Only the fields that count, in calculate_match_score order
+        self.exact_terms = [(model, field, self.weights[field]) for model, field in EXACT_FIELDS if self.weights[field]]
+        self.list_terms = [(field, self.weights[field]) for field in LIST_FIELDS if self.weights[field]]
+
+
+_plan = ScoringPlan()
+
+
+def init_scoring_plan(app):
+    """Compile MATCH_WEIGHTS (a dict or JSON object of field -> points) for every scorer in this process."""
+    global _plan
+    weights = app.config.get("MATCH_WEIGHTS")
+    _plan = ScoringPlan(json.loads(weights) if isinstance(weights, str) else weights)
+
+
+def get_scoring_plan():
+    return _plan
+
+
+class TraitPostings:
+    """
+    One list field of a pool as postings: for each token, the sorted rows holding it.
+
+    An overlap only reads the rows of the tokens asked about, and memory grows
+    with the tokens stored rather than rows times vocabulary, so free-text
+    values that make the vocabulary large cost nothing extra.
+    """
+
+    def __init__(self, token_sets):
+        self.vocab = {}
+        rows, ids = [], []
+        for i, tokens in enumerate(token_sets):
+            for token in tokens:
+                rows.append(i)
+                ids.append(self.vocab.setdefault(token, len(self.vocab)))
+
+        ids = np.array(ids, dtype=np.int64)
+        # A stable sort keeps each token's rows ascending
+        self.rows = np.array(rows, dtype=np.int32)[np.argsort(ids, kind="stable")]
+        self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ids, minlength=len(self.vocab)), out=self.offsets[1:])
+        self.size = len(token_sets)
+
+    def token_ids(self, tokens):
+        """Ids of the given tokens, ignoring any the pool has never seen."""
+        return [self.vocab[token] for token in tokens if token in self.vocab]
+
+    def _rows_of(self, tokens):
+        return _concat([self.rows[self.offsets[t]:self.offsets[t + 1]] for t in self.token_ids(tokens)])
+
+    def overlap(self, tokens):
+        """Number of the given tokens each row holds, for every row."""
+        return np.bincount(self._rows_of(tokens), minlength=self.size)
+
+    def overlapping(self, tokens):
+        """Sorted rows holding at least one of the given tokens, and how many each holds."""
+        return np.unique(self._rows_of(tokens), return_counts=True)
+
+
+def _positions(values, sorted_rows):
+    """Index of each value in the sorted array `sorted_rows`, and whether it is there at all."""
+    if len(sorted_rows) == 0:
+        return np.zeros(len(values), dtype=np.intp), np.zeros(len(values), dtype=bool)
+    at = np.minimum(np.searchsorted(sorted_rows, values), len(sorted_rows) - 1)
+    return at, sorted_rows[at] == values
+
+
+def _in_sorted(values, sorted_rows):
+    """Which of `values` appear in the sorted array `sorted_rows`."""
+    return _positions(values, sorted_rows)[1]
+
+
+class MatchPool:
+    """Integer-coded snapshot of every candidate's love profile, scored in bulk with NumPy."""
+
+    def __init__(self, rows):
+        rows = list(rows)
+        size = len(rows)
+        birth_year_at = 2 + len(EXACT_FIELDS)
+        tokens_at = birth_year_at + 4
+
+        self.user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.nicknames = [row[1] for row in rows]
+
+        # 1. One integer column per exact-match field, values coded per field,
+        #    plus an inverted index of value code -> candidate rows
+        self.vocab = [{} for _ in EXACT_FIELDS]
+        self.codes = np.full((size, len(EXACT_FIELDS)), MISSING_VALUE, dtype=np.int32)
+        self.postings = []
+        for j, vocab in enumerate(self.vocab):
+            postings = {}
+            for i, row in enumerate(rows):
+                value = row[2 + j]
+                if value:
+                    code = vocab.setdefault(value, len(vocab))
+                    self.codes[i, j] = code
+                    postings.setdefault(code, []).append(i)
+            self.postings.append(_as_arrays(postings))
+
+        # 2. Multi-value fields as token postings, one per field
+        self.lists = [TraitPostings([row[tokens_at].get(field, ()) for row in rows]) for field in LIST_FIELDS]
+
+        # 3. Birth years (0 when unknown) with a sorted index for age range lookups
+        self.birth_years = np.array([row[birth_year_at] or 0 for row in rows], dtype=np.int32)
+        self.birth_order = np.argsort(self.birth_years, kind="stable")
+        self.sorted_birth_years = self.birth_years[self.birth_order]
+
+        # 4. Coordinates (NaN when unknown), bucketed by grid cell and by region
+        self.latitudes = np.array([row[birth_year_at + 1] for row in rows], dtype=np.float64)
+        self.longitudes = np.array([row[birth_year_at + 2] for row in rows], dtype=np.float64)
+        cells, regions = {}, {}
+        for i, row in enumerate(rows):
+            if row[birth_year_at + 1] is not None:
+                cells.setdefault(grid_cell(row[birth_year_at + 1], row[birth_year_at + 2]), []).append(i)
+            if row[birth_year_at + 3]:
+                regions.setdefault(row[birth_year_at + 3], []).append(i)
+        self.cell_postings = _as_arrays(cells)
+        self.region_postings = _as_arrays(regions)
+
+        self.row_of = {int(uid): i for i, uid in enumerate(self.user_ids)}
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _preference_codes(self, preferences):
+        return np.array([
+            vocab.get(trait_value(preferences, field), UNKNOWN_PREFERENCE) if trait_value(preferences, field) else UNKNOWN_PREFERENCE
+            for vocab, (_, field) in zip(self.vocab, EXACT_FIELDS)
+        ], dtype=np.int32)
+
+    def _list_terms(self, preferences, plan):
+        """For each scored list field with a preference: (field index, preference tokens, preference size, weight)."""
+        terms = []
+        tokens = trait_tokens(preferences)
+        for j, (field, weight) in enumerate(zip(LIST_FIELDS, plan.list_weights.tolist())):
+            pref_set = tokens[field]
+            if pref_set and weight:
+                terms.append((j, pref_set, len(pref_set), weight))
+        return terms
+
+    def rows_in_age(self, preferences):
+        """
+        Sorted rows whose birth year fits the preference's age range, or None when it sets no range.
+
+        Candidates without a birth year are kept, since nothing rules them out.
+        """
+        earliest, latest = birth_year_bounds(*age_limits(preferences))
+        if earliest is None and latest is None:
+            return None
+        years = self.sorted_birth_years
+        unknown = np.searchsorted(years, 0, side="right")
+        low = np.searchsorted(years, earliest, side="left") if earliest is not None else unknown
+        high = np.searchsorted(years, latest, side="right") if latest is not None else len(years)
+        return np.sort(np.concatenate([self.birth_order[:unknown], self.birth_order[max(low, unknown):high]]))
+
+    def rows_in_area(self, area):
+        """Sorted rows inside an Area: its region, its radius, or both. Rows without a location are left out."""
+        rows = None
+        if area.region:
+            rows = self.region_postings.get(area.region, _EMPTY)
+        if area.radius_km is not None:
+            near = _concat([self.cell_postings.get(cell, _EMPTY) for cell in cells_within(area.latitude, area.longitude, area.radius_km)])
+            near = near[distance_km(area.latitude, area.longitude, self.latitudes[near], self.longitudes[near]) <= area.radius_km]
+            rows = near if rows is None else np.intersect1d(rows, near)
+        return np.sort(rows) if rows is not None else None
+
+    def candidate_rows(self, preferences, area=None):
+        """Sorted rows that pass the age range and area filters, or None when nothing filters."""
+        domain = self.rows_in_age(preferences)
+        if area is not None:
+            in_area = self.rows_in_area(area)
+            if in_area is not None:
+                domain = in_area if domain is None else np.intersect1d(domain, in_area)
+        return domain
+
+    def score(self, preferences):
+        """Score every candidate against a MatchPreference, same result as calculate_match_score."""
+        plan = get_scoring_plan()
+        scores = ((self.codes == self._preference_codes(preferences)) @ plan.exact_weights).astype(np.float64)
+
+        # Added field by field so float rounding matches the scalar version
+        for j, pref_set, pref_size, weight in self._list_terms(preferences, plan):
+            scores += (self.lists[j].overlap(pref_set) / pref_size) * weight
+
+        return scores
+
+    def rank(self, preferences):
+        """Return row indices and truncated scores, best first, ties broken by user id."""
+        scores = self.score(preferences).astype(np.int64)
+        order = np.lexsort((self.user_ids, -scores))
+        return order, scores[order]
+
+    def top_k(self, preferences, k, exclude_user_ids=(), area=None):
+        """
+        Return up to k (row, score) pairs, best first, ties broken by user id.
+
+        Candidates outside the preference's age range or the Area are dropped first. Of the
+        rest, only rows found in the exact-field or list-token postings are
+        looked at, and rows whose upper bound cannot reach the k-th best
+        exact-field score are dropped before the list fractions are added.
+        Candidates scoring zero are left out.
+        """
+        plan = get_scoring_plan()
+        domain = self.candidate_rows(preferences, area)
+        pref_codes = self._preference_codes(preferences)
+        hits = [
+            (self.postings[j].get(int(code), _EMPTY), weight)
+            for j, (code, weight) in enumerate(zip(pref_codes.tolist(), plan.exact_weights.tolist())) if code >= 0 and weight
+        ]
+        exact_hits = _concat([rows for rows, _ in hits])
+        hit_weights = np.concatenate([np.full(len(rows), weight, dtype=np.int64) for rows, weight in hits] or [_EMPTY])
+        overlaps = []
+        for j, pref_set, pref_size, weight in self._list_terms(preferences, plan):
+            rows, counts = self.lists[j].overlapping(pref_set)
+            if domain is not None:
+                keep = _in_sorted(rows, domain)
+                rows, counts = rows[keep], counts[keep]
+            overlaps.append((rows, counts, pref_size, weight))
+        if domain is not None:
+            keep = _in_sorted(exact_hits, domain)
+            exact_hits, hit_weights = exact_hits[keep], hit_weights[keep]
+
+        touched = np.unique(_concat([exact_hits] + [rows for rows, _, _, _ in overlaps]))
+        excluded = [self.row_of[int(uid)] for uid in exclude_user_ids if int(uid) in self.row_of]
+        if excluded:
+            touched = touched[~np.isin(touched, excluded)]
+        if len(touched) == 0 or k <= 0:
+            return []
+
+        # 1. Exact fields give a lower bound, each list field adds at most its weight
+        at, found = _positions(exact_hits, touched)
+        lower = np.bincount(at[found], weights=hit_weights[found], minlength=len(touched)).astype(np.int64)
+        upper = lower.copy()
+        for i, (rows, counts, pref_size, weight) in enumerate(overlaps):
+            at, found = _positions(touched, rows)
+            overlap = np.where(found, counts[at] if len(counts) else 0, 0)
+            overlaps[i] = (overlap, pref_size, weight)
+            upper += found * weight
+
+        # 2. Nothing below the k-th best lower bound can make the list
+        if len(touched) > k:
+            threshold = np.partition(lower, -k)[-k]
+            keep = upper >= threshold
+            touched, lower = touched[keep], lower[keep]
+            overlaps = [(overlap[keep], pref_size, weight) for overlap, pref_size, weight in overlaps]
+
+        # 3. Exact scores for the survivors, then a heap for the final k
+        scores = lower.astype(np.float64)
+        for overlap, pref_size, weight in overlaps:
+            scores += (overlap / pref_size) * weight
+
+        best = heapq.nlargest(
+            k,
+            zip(scores.astype(np.int64).tolist(), (-self.user_ids[touched]).tolist(), touched.tolist())
+        )
+        return [(row, score) for score, _, row in best]
+
+
+class PreferencePool:
+    """
+    Every stored MatchPreference of an account type, coded so one profile can be scored against all of them.
+
+    Users with the same preference signature share one coded row, so a profile
+    is scored once per distinct preference set.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        signature_at = 1 + len(EXACT_FIELDS)
+        tokens_at = signature_at + 3
+
+        self.user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+
+        # 1. One row per signature, signature_rows maps each user to theirs
+        signatures = [row[signature_at] for row in rows]
+        self.signatures, first, self.signature_rows = np.unique(
+            np.array(signatures, dtype=object).astype(str), return_index=True, return_inverse=True
+        )
+        rows = [rows[i] for i in first]
+        size = len(rows)
+
+        # 2. Wanted values coded per field, unset preferences never match
+        self.vocab = [{} for _ in EXACT_FIELDS]
+        self.codes = np.full((size, len(EXACT_FIELDS)), UNKNOWN_PREFERENCE, dtype=np.int32)
+        for j, vocab in enumerate(self.vocab):
+            for i, row in enumerate(rows):
+                value = row[1 + j]
+                if value:
+                    self.codes[i, j] = vocab.setdefault(value, len(vocab))
+
+        # 3. Age ranges, open ends as limits nobody reaches
+        self.age_min = np.array([row[signature_at + 1] if row[signature_at + 1] is not None else -1 for row in rows], dtype=np.int32)
+        self.age_max = np.array([row[signature_at + 2] if row[signature_at + 2] is not None else 1000 for row in rows], dtype=np.int32)
+
+        # 4. Wanted tokens as postings per field, plus each preference's size
+        self.lists = []
+        self.sizes = np.zeros((size, len(LIST_FIELDS)), dtype=np.int32)
+        for j, field in enumerate(LIST_FIELDS):
+            token_sets = [row[tokens_at].get(field, ()) for row in rows]
+            self.sizes[:, j] = [len(tokens) for tokens in token_sets]
+            self.lists.append(TraitPostings(token_sets))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def score(self, profile):
+        """
+        Score one profile (see profile_values) against every preference, same result as
+        calculate_match_score except zero where the profile's age is outside the preference's range.
+        """
+        return self.score_signatures(profile)[self.signature_rows]
+
+    def score_signatures(self, profile):
+        """Score one profile against each distinct preference set, aligned with self.signatures."""
+        plan = get_scoring_plan()
+        profile_codes = np.array([
+            vocab.get(profile.get(field), MISSING_VALUE) if profile.get(field) else MISSING_VALUE
+            for vocab, (_, field) in zip(self.vocab, EXACT_FIELDS)
+        ], dtype=np.int32)
+        scores = ((self.codes == profile_codes) @ plan.exact_weights).astype(np.float64)
+
+        for j, (postings, field, weight) in enumerate(zip(self.lists, LIST_FIELDS, plan.list_weights.tolist())):
+            tokens = profile.get(field)
+            if not tokens or not weight:
+                continue
+            overlap = postings.overlap(tokens)
+            sizes = self.sizes[:, j]
+            scores += np.divide(overlap, sizes, out=np.zeros(len(sizes)), where=sizes > 0) * weight
+
+        birth_year = profile.get("birth_year")
+        if birth_year:
+            age = date.today().year - birth_year  # age at the end of this year, one less before the birthday
+            scores[(self.age_max < age - 1) | (self.age_min > age)] = 0
+        return scores
+
+
+def reciprocal_top_k(pool, prefs, preferences, profile, k, exclude_user_ids=(), area=None):
+    """
+    Return up to k (row, score) pairs ranked by the harmonic mean of both directions:
+    how well each candidate fits `preferences`, and how well `profile` fits the
+    candidate's own preferences. Each direction is one pass over its pool, and a
+    candidate without stored preferences scores zero.
+    """
+    forward = pool.score(preferences)
+
+    # Both pools are ordered by user id, so preference rows line up with pool rows by search
+    backward = np.zeros(len(pool))
+    rows = np.searchsorted(pool.user_ids, prefs.user_ids)
+    found = rows < len(pool)
+    found[found] = pool.user_ids[rows[found]] == prefs.user_ids[found]
+    backward[rows[found]] = prefs.score(profile)[found]
+
+    total = forward + backward
+    scores = np.divide(2 * forward * backward, total, out=np.zeros(len(pool)), where=total > 0)
+
+    domain = pool.candidate_rows(preferences, area)
+    if domain is not None:
+        outside = np.ones(len(pool), dtype=bool)
+        outside[domain] = False
+        scores[outside] = 0
+
+    candidates = np.flatnonzero(scores > 0)
+    excluded = [pool.row_of[int(uid)] for uid in exclude_user_ids if int(uid) in pool.row_of]
+    if excluded:
+        candidates = candidates[~np.isin(candidates, excluded)]
+    truncated = scores[candidates].astype(np.int64)
+    order = np.lexsort((pool.user_ids[candidates], -truncated))[:k]
+    return [(int(candidates[i]), int(truncated[i])) for i in order]
+
+
+def profile_values(love_basic_info, personality):
+    """Flatten a candidate's LoveBasicInfo and UserPersonality into the fields matching reads, list fields as token sets."""
+    values = {field: trait_value(love_basic_info if model is LoveBasicInfo else personality, field) for model, field in EXACT_FIELDS}
+    values["birth_year"] = love_basic_info.birth_year or getattr(love_basic_info.date_of_birth, "year", None)
+    values.update(trait_tokens(personality))
+    return values
+
+
+_EMPTY = np.array([], dtype=np.int32)
+
+
+def _as_arrays(postings):
+    return {code: np.array(rows, dtype=np.int32) for code, rows in postings.items()}
+
+
+def _concat(arrays):
+    arrays = [a for a in arrays if len(a)]
+    return np.concatenate(arrays) if arrays else _EMPTY
+
+
+def load_match_pool(account_type):
+    """Build a MatchPool from plain column rows, without hydrating ORM objects."""
+    columns = [LoveBasicInfo.user_id, LoveBasicInfo.nickname]
+    columns += [trait_column(model, field) for model, field in EXACT_FIELDS]
+    columns += [LoveBasicInfo.birth_year, LoveBasicInfo.latitude, LoveBasicInfo.longitude, LoveBasicInfo.region]
+    columns.append(UserPersonality.trait_tokens)
+
+    rows = (
+        db.session.query(*columns)
+        .join(UserPersonality, UserPersonality.user_id == LoveBasicInfo.user_id)
+        .join(User, User.id == LoveBasicInfo.user_id)
+        .filter(User.account_type == account_type)
+        .order_by(LoveBasicInfo.user_id)
+        .all()
+    )
+    return MatchPool(_with_tokens(UserPersonality, rows))
+
+
+def load_preference_pool(account_type):
+    """Build a PreferencePool from plain column rows."""
+    columns = [MatchPreference.user_id]
+    columns += [trait_column(MatchPreference, field) for _, field in EXACT_FIELDS]
+    columns += [MatchPreference.signature, MatchPreference.age_min, MatchPreference.age_max, MatchPreference.trait_tokens]
+
+    rows = (
+        db.session.query(*columns)
+        .join(User, User.id == MatchPreference.user_id)
+        .filter(User.account_type == account_type)
+        .order_by(MatchPreference.user_id)
+        .all()
+    )
+    return PreferencePool(_with_signatures(_with_tokens(MatchPreference, rows)))
+
+
+def _with_signatures(rows):
+    """
+    Fill in the signature of preference rows written before it existed.
+
+    The pool reads picklist ids, the signature hashes the text like
+    preference_signature, so the text is loaded for those rows.
+    """
+    signature_at = 1 + len(EXACT_FIELDS)
+    missing = [row[0] for row in rows if row[signature_at] is None]
+    if not missing:
+        return rows
+
+    texts = {}
+    for start in range(0, len(missing), 500):
+        query = db.session.query(MatchPreference.user_id, *[getattr(MatchPreference, field) for _, field in EXACT_FIELDS])
+        for user_id, *values in query.filter(MatchPreference.user_id.in_(missing[start:start + 500])):
+            texts[user_id] = values
+    return [
+        tuple(row[:signature_at]) + (_signature(texts[row[0]], row[-1]),) + tuple(row[signature_at + 1:])
+        if row[signature_at] is None else row
+        for row in rows
+    ]
+
+
+def _with_tokens(model, rows):
+    """Fill in trait_tokens (the last column) for rows written before it existed."""
+    missing = [row[0] for row in rows if row[-1] is None]
+    if not missing:
+        return rows
+
+    parsed = {}
+    for start in range(0, len(missing), 500):
+        texts = db.session.query(model.user_id, *[getattr(model, field) for field in LIST_FIELDS]).filter(
+            model.user_id.in_(missing[start:start + 500])
+        )
+        for user_id, *values in texts:
+            parsed[user_id] = {field: split_traits(value) for field, value in zip(LIST_FIELDS, values)}
+    return [tuple(row[:-1]) + (parsed.get(row[0], {}),) if row[-1] is None else row for row in rows]
+
+
+def sql_top_k(preferences, account_type, k, exclude_user_ids=(), area=None):
+    """
+    Database-side alternative to MatchPool.top_k, returning (user_id, score) pairs.
+
+    The exact-match part of the score is a SUM(CASE ...) computed by the database.
+    The k candidates with the best exact scores are scored in full first; the
+    lowest of those scores is a floor the final k-th best cannot fall below.
+    The preference's non-empty list fields add at most their weight each, so
+    only candidates whose exact score is within that margin of the floor are
+    loaded to add the overlaps in Python. How much that cuts depends on how far
+    list overlaps lift the top candidates, with few or light list fields
+    almost nothing is loaded past the floor. A radius is narrowed to grid cells
+    in the query and checked exactly on the loaded rows, so the cut is skipped
+    then.
+    """
+    plan = get_scoring_plan()
+    terms = []
+    for model, field, weight in plan.exact_terms:
+        wanted = trait_value(preferences, field)
+        if wanted:
+            terms.append(db.case((trait_column(model, field) == wanted, weight), else_=0))
+    exact = sum(terms, db.literal(0))
+
+    pref_tokens = trait_tokens(preferences)
+    list_terms = [(field, weight) for field, weight in plan.list_terms if pref_tokens[field]]
+    margin = sum(weight for _, weight in list_terms)
+
+    query = (
+        db.session.query(LoveBasicInfo.user_id)
+        .join(UserPersonality, UserPersonality.user_id == LoveBasicInfo.user_id)
+        .join(User, User.id == LoveBasicInfo.user_id)
+        .filter(User.account_type == account_type)
+    )
+    excluded = [int(uid) for uid in exclude_user_ids]
+    if excluded:
+        query = query.filter(User.id.notin_(excluded))
+
+    # Age range as an indexed birth_year range, candidates without one are kept
+    earliest, latest = birth_year_bounds(*age_limits(preferences))
+    if earliest is not None:
+        query = query.filter(or_(LoveBasicInfo.birth_year.is_(None), LoveBasicInfo.birth_year >= earliest))
+    if latest is not None:
+        query = query.filter(or_(LoveBasicInfo.birth_year.is_(None), LoveBasicInfo.birth_year <= latest))
+
+    radius = area.radius_km if area is not None else None
+    if area is not None and area.region:
+        query = query.filter(LoveBasicInfo.region == area.region)
+    if radius is not None:
+        query = query.filter(LoveBasicInfo.geo_cell.in_(cells_within(area.latitude, area.longitude, radius)))
+
+    columns = (
+        LoveBasicInfo.user_id, exact, LoveBasicInfo.latitude, LoveBasicInfo.longitude, UserPersonality.trait_tokens
+    )
+
+    def full_score(exact_score, tokens):
+        # Overlaps added in calculate_match_score order
+        score = exact_score
+        for field, weight in list_terms:
+            overlap = pref_tokens[field] & set(tokens.get(field, ()))
+            score += (len(overlap) / len(pref_tokens[field])) * weight
+        return score
+
+    # 1. Full scores of the best k by exact score give a floor for the k-th best,
+    #    compared truncated since ties on the truncated score go to the lower user id
+    if radius is None:
+        seed = query.with_entities(*columns).order_by(exact.desc()).limit(k).all()
+        if len(seed) == k:
+            floor = min(int(full_score(exact_score, tokens)) for _, exact_score, _, _, tokens in _with_tokens(UserPersonality, seed))
+            query = query.filter(exact >= floor - margin)
+
+    # 2. Full scores for the rows that can still reach the floor
+    rows = query.with_entities(*columns).all()
+    scored = []
+    for user_id, exact_score, latitude, longitude, tokens in _with_tokens(UserPersonality, rows):
+        if radius is not None and distance_km(area.latitude, area.longitude, latitude, longitude) > radius:
+            continue
+        score = full_score(exact_score, tokens)
+        if score > 0:
+            scored.append((int(score), -user_id, user_id))
+
+    return [(user_id, score) for score, _, user_id in heapq.nlargest(k, scored)]
+
+
+# Pools are shared by every request in the process and rebuilt once a write
+# here commits, or after MATCH_POOL_TTL seconds for writes made by other
+# workers. A rebuild runs outside the lock, once per pool, and requests keep
+# using the stale pool until it is done.
+_pools = {}  # (kind, account_type) -> (built_at, generation, pool)
+_generations = {}  # kind -> bumped by each commit that changes the pools of that kind
+_building = set()
+_pools_lock = threading.Lock()
+
+
+def _build_pool(pool_key, loader, generation):
+    try:
+        pool = loader(pool_key[1])
+        with _pools_lock:
+            # Stored under the generation it was loaded at, a commit made meanwhile leaves it stale
+            _pools[pool_key] = (time.monotonic(), generation, pool)
+        return pool
+    finally:
+        with _pools_lock:
+            _building.discard(pool_key)
+
+
+def _cached_pool(key, loader, account_type):
+    ttl = current_app.config.get("MATCH_POOL_TTL", 300)
+    pool_key = (key, account_type)
+    with _pools_lock:
+        cached = _pools.get(pool_key)
+        generation = _generations.get(key, 0)
+        if cached:
+            built_at, built_generation, pool = cached
+            if built_generation == generation and time.monotonic() - built_at < ttl:
+                return pool
+            if pool_key in _building:
+                return pool
+        _building.add(pool_key)
+    return single_flight.do(("match_pool",) + pool_key, lambda: _build_pool(pool_key, loader, generation))
+
+
+def get_match_pool(account_type):
+    """Return the cached MatchPool for an account type, rebuilding it when stale."""
+    return _cached_pool("candidates", load_match_pool, account_type)
+
+
+def get_preference_pool(account_type):
+    """Return the cached PreferencePool for an account type, rebuilding it when stale."""
+    return _cached_pool("preferences", load_preference_pool, account_type)
+
+
+def reset_match_pools():
+    """Forget every cached pool, for a process that does not see the writes that made them stale."""
+    with _pools_lock:
+        _pools.clear()
+
+
+def _invalidator(key):
+    def invalidate(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("match_pools_stale", set()).add(key)
+    return invalidate
+
+
+for _model, _key in ((LoveBasicInfo, "candidates"), (UserPersonality, "candidates"), (MatchPreference, "preferences")):
+    for _name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _name, _invalidator(_key))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_pools(session):
+    # Only once committed, so a rebuild never caches rows that may still roll back
+    stale = session.info.pop("match_pools_stale", None)
+    if stale:
+        with _pools_lock:
+            for key in stale:
+                _generations[key] = _generations.get(key, 0) + 1
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_stale_pools(session, previous_transaction):
+    # Only the outermost rollback drops them, a savepoint rolling back leaves the enclosing changes pending
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop("match_pools_stale", None)
+
+for _model in (UserPersonality, MatchPreference):
+    event.listen(_model, "before_insert", normalize_trait_tokens)
+    event.listen(_model, "before_update", normalize_trait_tokens)
+
+# After the tokens, which the signature is computed from
+event.listen(MatchPreference, "before_insert", set_preference_signature)
+event.listen(MatchPreference, "before_update", set_preference_signature)
+
+for _model, _listener in ((LoveBasicInfo, set_birth_year), (LoveBasicInfo, set_location), (MatchPreference, set_age_limits)):
+    event.listen(_model, "before_insert", _listener)
+    event.listen(_model, "before_update", _listener)
+
+
+def backfill_trait_tokens(batch_size=500):
+    """Normalize list fields of rows stored before trait_tokens existed."""
+    for model in (UserPersonality, MatchPreference):
+        while True:
+            rows = (
+                model.query.options(*[db.undefer(getattr(model, field)) for field in LIST_FIELDS])
+                .filter(model.trait_tokens.is_(None)).limit(batch_size).all()
+            )
+            if not rows:
+                break
+            for row in rows:
+                normalize_trait_tokens(None, None, row)
+            db.session.commit()
+
+
+def backfill_preference_signatures(batch_size=500):
+    """Compute signatures of MatchPreference rows stored before the column existed."""
+    while True:
+        rows = MatchPreference.query.filter(MatchPreference.signature.is_(None)).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            set_preference_signature(None, None, row)
+        db.session.commit()
+
+
+def backfill_derived_fields(batch_size=500):
+    """Derive birth_year, age_min/age_max and resolved locations for rows stored before those columns existed."""
+    # Only rows whose derived column is still empty, so reruns skip finished rows
+    for model, source, underived, listener in (
+        (LoveBasicInfo, LoveBasicInfo.date_of_birth, LoveBasicInfo.birth_year.is_(None), set_birth_year),
+        (LoveBasicInfo, LoveBasicInfo.current_location, LoveBasicInfo.latitude.is_(None), set_location),
+        (MatchPreference, MatchPreference.age_range,
+         and_(MatchPreference.age_min.is_(None), MatchPreference.age_max.is_(None)), set_age_limits),
+    ):
+        last_id = 0
+        while True:
+            rows = (
+                model.query.filter(model.id > last_id, source.isnot(None), underived)
+                .order_by(model.id).limit(batch_size).all()
+            )
+            if not rows:
+                break
+            for row in rows:
+                listener(None, None, row)
+            last_id = rows[-1].id
+            db.session.commit()
@@ -16,7 +16,12 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True, nullable=True)
     phone = db.Column(db.String(20), unique=True, nullable=True)
-    profile_pic = db.Column(db.Text, nullable=True)
+    profile_pic_hash = db.Column(db.String(64), nullable=True, index=True)  # picture bytes live in core.blob_store
+    # Picture metadata, detected once when it is saved
+    profile_pic_mime = db.Column(db.String(50), nullable=True)
+    profile_pic_width = db.Column(db.Integer, nullable=True)
+    profile_pic_height = db.Column(db.Integer, nullable=True)
+    profile_pic_bytes = db.Column(db.Integer, nullable=True)
     username = db.Column(db.String(100), unique=True, nullable=True)
     password_hash = db.Column(db.String(200), nullable=True) 
     referral_code = db.Column(db.String(20), unique=True, nullable=True)
@@ -40,12 +45,21 @@ class LoveBasicInfo(db.Model):
     nickname = db.Column(db.String(100), nullable=True)
     fullname = db.Column(db.String(250), nullable=True)
     date_of_birth = db.Column(db.Date, nullable=True)
+    birth_year = db.Column(db.Integer, nullable=True, index=True)  # from date_of_birth, see core.matching
     age_range = db.Column(db.String(50), nullable=True)
     marital_status = db.Column(db.String(50), nullable=True)
     country_of_origin = db.Column(db.String(100), nullable=True)
     tribe = db.Column(db.String(100), nullable=True)
     current_location = db.Column(db.String(100), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)  # current_location resolved by core.geo
+    longitude = db.Column(db.Float, nullable=True)
+    region = db.Column(db.String(8), nullable=True, index=True)
+    geo_cell = db.Column(db.Integer, nullable=True, index=True)
     skin_tone = db.Column(db.String(50), nullable=True)
+    # Picklist values as trait_values ids, kept in step with the text by core.traits
+    marital_status_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    tribe_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    skin_tone_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
 
 
 class UserPersonality(db.Model):
@@ -57,16 +71,24 @@ class UserPersonality(db.Model):
     body_type = db.Column(db.String(250), nullable=True)
     hair_colour = db.Column(db.String(250), nullable=True)
     hair_style = db.Column(db.String(250), nullable=True)
-    interest = db.Column(db.Text, nullable=True)
-    hobbies = db.Column(db.Text, nullable=True)
-    music = db.Column(db.Text, nullable=True)
-    movies = db.Column(db.Text, nullable=True)
-    activities = db.Column(db.Text, nullable=True)
-    personality = db.Column(db.Text, nullable=True)
+    # Free-text lists are loaded only by queries that undefer their group; matching reads trait_tokens
+    interest = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
+    hobbies = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
+    music = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
+    movies = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
+    activities = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
+    personality = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
     religion = db.Column(db.String(250), nullable=True)
     education = db.Column(db.String(250), nullable=True)
     languages = db.Column(db.String(250), nullable=True)
-    values = db.Column(db.Text, nullable=True)
+    values = db.deferred(db.Column(db.Text, nullable=True), group="personality_lists")
+    trait_tokens = db.Column(db.JSON, nullable=True)  # list fields parsed on write, see core.matching
+    # Picklist values as trait_values ids, kept in step with the text by core.traits
+    eye_colour_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    body_type_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    hair_colour_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    religion_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    education_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
 
 
 class MatchPreference(db.Model):
@@ -87,13 +109,98 @@ class MatchPreference(db.Model):
     religion = db.Column(db.String(250), nullable=True)
     education = db.Column(db.String(250), nullable=True)
     languages = db.Column(db.Text, nullable=True)
-    values = db.Column(db.Text, nullable=True)
-    interest = db.Column(db.Text, nullable=True)
-    hobbies = db.Column(db.Text, nullable=True)
-    music = db.Column(db.Text, nullable=True)
-    movies = db.Column(db.Text, nullable=True)
-    activities = db.Column(db.Text, nullable=True)
+    # Loaded only by queries that undefer the group, like UserPersonality's lists
+    values = db.deferred(db.Column(db.Text, nullable=True), group="preference_lists")
+    interest = db.deferred(db.Column(db.Text, nullable=True), group="preference_lists")
+    hobbies = db.deferred(db.Column(db.Text, nullable=True), group="preference_lists")
+    music = db.deferred(db.Column(db.Text, nullable=True), group="preference_lists")
+    movies = db.deferred(db.Column(db.Text, nullable=True), group="preference_lists")
+    activities = db.deferred(db.Column(db.Text, nullable=True), group="preference_lists")
     personality = db.Column(db.String(250), nullable=True)
+    trait_tokens = db.Column(db.JSON, nullable=True)  # list fields parsed on write, see core.matching
+    signature = db.Column(db.String(40), nullable=True, index=True)  # hash of the scored fields, see core.matching
+    age_min = db.Column(db.Integer, nullable=True)  # parsed from age_range, see core.matching
+    age_max = db.Column(db.Integer, nullable=True)
+    # Picklist values as trait_values ids, kept in step with the text by core.traits
+    marital_status_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    tribe_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    skin_tone_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    eye_colour_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    body_type_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    hair_colour_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    religion_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+    education_id = db.Column(db.Integer, db.ForeignKey('trait_values.id'), nullable=True)
+
+
+class TraitValue(db.Model):
+    # One row per distinct value of a picklist field, referenced by integer ids
+    __tablename__ = 'trait_values'
+    __table_args__ = (
+        db.UniqueConstraint('field', 'value', name='uq_trait_values_field_value'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    field = db.Column(db.String(50), nullable=False)
+    value = db.Column(db.String(250), nullable=False)
+
+
+class MatchScore(db.Model):
+    # Ranked candidates per preference signature, shared by every user with that signature
+    __tablename__ = 'signature_match_scores'
+    __table_args__ = (
+        db.UniqueConstraint('account_type', 'signature', 'candidate_id', name='uq_signature_match_scores_entry'),
+        db.Index('ix_signature_match_scores_list', 'account_type', 'signature', 'score'),
+        db.Index('ix_signature_match_scores_candidate', 'candidate_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_type = db.Column(db.String(20), nullable=False)
+    signature = db.Column(db.String(40), nullable=False)
+    candidate_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+
+class MatchJob(db.Model):
+    # Durable queue of match list updates, run by `flask match-worker`, see core.match_jobs
+    __tablename__ = 'match_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(80), unique=True, nullable=False)  # one pending job per user, signature or rebuild
+    kind = db.Column(db.String(20), nullable=False)  # user | signature | rebuild
+    user_id = db.Column(db.Integer, nullable=True)
+    account_type = db.Column(db.String(20), nullable=True)
+    signature = db.Column(db.String(40), nullable=True)
+    requests = db.Column(db.Integer, default=1, nullable=False)  # bumped when queued again while pending
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    claimed_until = db.Column(db.DateTime, nullable=True, index=True)
+    last_error = db.Column(db.Text, nullable=True)
+    queued_by = db.Column(db.String(80), nullable=True)  # host:pid that queued it, None when several did
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MatchWeight(db.Model):
+    # The MATCH_WEIGHTS the stored match lists were computed with, see core.match_store
+    __tablename__ = 'match_weights'
+
+    field = db.Column(db.String(50), primary_key=True)
+    weight = db.Column(db.Integer, nullable=False)
+
+
+class ImageRendition(db.Model):
+    # Resized copy of a stored picture, itself a blob, see core.thumbnails
+    __tablename__ = 'image_renditions'
+    __table_args__ = (
+        db.UniqueConstraint('source_hash', 'size', 'format', name='uq_image_renditions_source_size_format'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_hash = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # fits within size x size pixels
+    format = db.Column(db.String(10), nullable=False)  # webp | jpeg
+    blob_hash = db.Column(db.String(64), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    bytes = db.Column(db.Integer, nullable=False)
 
 
 class BusinessBasicInfo(db.Model):
@@ -123,9 +230,10 @@ class BusinessCredentials(db.Model):
 
     profession = db.Column(db.String(250), nullable=True)
     YearsOfExperience = db.Column(db.Integer, nullable=True)
-    skills = db.Column(db.Text, nullable=True)
-    description = db.Column(db.Text, nullable=True)
-    businessInterests = db.Column(db.Text, nullable=True)
+    # Long text, loaded only by queries that undefer the group
+    skills = db.deferred(db.Column(db.Text, nullable=True), group="credentials_text")
+    description = db.deferred(db.Column(db.Text, nullable=True), group="credentials_text")
+    businessInterests = db.deferred(db.Column(db.Text, nullable=True), group="credentials_text")
 
 
 class BusinessAnonymous(db.Model):
@@ -137,8 +245,8 @@ class BusinessAnonymous(db.Model):
 
 class Connection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
     status = db.Column(db.String(20), nullable=False, default='pending')
 
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_connections')
@@ -147,8 +255,8 @@ class Connection(db.Model):
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -0,0 +1,23 @@
+from sqlalchemy.exc import IntegrityError
+
+
+# Rows keyed by a unique constraint (a job key, a trait value, a rendition)
+# can be inserted by two workers at once. The insert runs in a savepoint, so
+# when the other worker wins only the savepoint rolls back and the caller's
+# transaction stays usable; the caller then reads or updates the row that
+# won.
+
+
+def try_insert(target, insert):
+    """
+    Run insert() in a savepoint of `target` (a Session or a Connection).
+
+    Returns True when the row went in, False when a unique constraint said
+    another transaction stored it first.
+    """
+    try:
+        with target.begin_nested():
+            insert()
+        return True
+    except IntegrityError:
+        return False
@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text
+from core.extensions import db
+
+
+def upgrade_schema():
+    """
+    Bring an existing database up to the current models.
+
+    db.create_all() only creates missing tables, so columns added to existing
+    models are appended here (all of them are nullable), and indexes added to
+    existing models are created.
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            added = [column for column in table.columns if column.name not in existing]
+            for column in added:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+                ))
+                print(f"Added column {table.name}.{column.name}")
+
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
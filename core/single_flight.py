@@ -0,0 +1,60 @@
+from core.imports import threading
+
+
+# Concurrent identical requests (same key, typically the endpoint, the user and
+# the query parameters) share one computation: the first caller runs it, the
+# others wait for its result instead of repeating the queries. This works
+# between the threads of one process; across processes the shared cache takes
+# over once the first result is stored. Results are handed to every waiter, so
+# they must be plain data (dicts, lists), never ORM objects or responses.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.timeout = app.config.get("SINGLE_FLIGHT_TIMEOUT", self.timeout)
+
+    def do(self, key, fn):
+        """
+        Return fn(), running it once for all concurrent callers with the same key.
+
+        Waiters get the leader's result or exception. A waiter that has waited
+        `timeout` seconds gives up and runs fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor
+import cloudinary.utils
+from flask import current_app, url_for
+from PIL import ImageOps, UnidentifiedImageError
+from core.imports import io, threading, Image
+from core.extensions import db
+from core.savepoint import try_insert
+from core.models import ImageRendition
+from core.blob_store import blob_store
+from core.single_flight import single_flight
+
+
+# List views (match cards, contacts, the business homepage) show pictures far
+# smaller than they are uploaded. Every stored profile picture gets renditions
+# that fit within each of RENDITION_SIZES pixels, in WebP and JPEG, stored as
+# blobs like the original. A small thread pool renders them right after the
+# upload; one that is missing (pool full, process restarted, older picture) is
+# rendered on its first request. Gallery photos live on Cloudinary, which
+# renders the same sizes itself and picks the format per browser (f_auto):
+# the WebP ones most browsers get are requested eagerly on upload, the rest
+# are rendered by Cloudinary on first request.
+
+RENDITION_SIZES = (64, 256, 1024)
+RENDITION_FORMATS = ("webp", "jpeg")
+RENDITION_MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+_QUALITY = 80
+
+
+def rendition_size(size):
+    """The smallest rendition size of at least `size` pixels, the largest when none is."""
+    for rendition in RENDITION_SIZES:
+        if rendition >= size:
+            return rendition
+    return RENDITION_SIZES[-1]
+
+
+def profile_pic_url(digest, size=None):
+    """
+    URL clients load a stored profile picture from, None when there is none.
+
+    The URL is relative to the API host, so cached match pages stay valid
+    whichever host served them. With a size, it is that of the smallest
+    rendition covering it, in the format the client accepts.
+    """
+    if not digest:
+        return None
+    if size:
+        return url_for("images.get_image", digest=digest, size=rendition_size(size))
+    return blob_store.url(digest) or url_for("images.get_image", digest=digest)
+
+
+def _render(image, size, fmt):
+    mode = "RGB" if fmt == "jpeg" or image.mode not in ("RGBA", "LA", "P") else "RGBA"
+    copy = image.convert(mode) if image.mode != mode else image.copy()
+    copy.thumbnail((size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    copy.save(out, format=fmt.upper(), quality=_QUALITY)
+    return out.getvalue(), copy.size
+
+
+def make_renditions(source_hash, wanted=None):
+    """
+    Render and store the missing renditions of a picture, all of them by default.
+
+    The picture is decoded once for the batch. Pictures that are missing or do
+    not decode are reported and left without renditions.
+    """
+    wanted = wanted or [(size, fmt) for size in RENDITION_SIZES for fmt in RENDITION_FORMATS]
+    existing = {(r.size, r.format) for r in ImageRendition.query.filter_by(source_hash=source_hash)}
+    missing = [key for key in wanted if key not in existing]
+    if not missing:
+        return
+
+    image_bytes = blob_store.get(source_hash)
+    if image_bytes is None:
+        current_app.logger.warning("Picture %s is missing from the blob store", source_hash)
+        return
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # JPEG decodes straight at a fraction of its size when that is enough
+        largest = max(size for size, _ in missing)
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError) as e:
+        current_app.logger.warning("Picture %s could not be read: %s", source_hash, e)
+        return
+
+    for size, fmt in missing:
+        data, (width, height) = _render(image, size, fmt)
+        rendition = ImageRendition(
+            source_hash=source_hash, size=size, format=fmt,
+            blob_hash=blob_store.put(data), width=width, height=height, bytes=len(data)
+        )
+        # Another worker may store the same rendition first, theirs is kept
+        try_insert(db.session, lambda: db.session.add(rendition))
+    db.session.commit()
+
+
+def get_rendition(source_hash, size, fmt):
+    """The stored rendition of a picture, rendered now if it is not there yet. None when it cannot be."""
+    size = rendition_size(size)
+    query = ImageRendition.query.filter_by(source_hash=source_hash, size=size, format=fmt)
+    rendition = query.first()
+    if rendition is None:
+        single_flight.do(
+            ("rendition", source_hash, size, fmt), lambda: make_renditions(source_hash, [(size, fmt)])
+        )
+        rendition = query.first()
+        if rendition is not None:
+            # The other sizes are likely wanted soon too
+            schedule_renditions(source_hash)
+    return rendition
+
+
+_pool = None
+_pending = set()
+_pool_lock = threading.Lock()
+
+
+def schedule_renditions(source_hash):
+    """
+    Render a picture's renditions on the thumbnail pool.
+
+    At most THUMBNAIL_QUEUE pictures wait at a time; beyond that the picture
+    is skipped and its renditions are rendered when first requested.
+    """
+    global _pool
+    app = current_app._get_current_object()
+    with _pool_lock:
+        if source_hash in _pending:
+            return
+        if len(_pending) >= app.config.get("THUMBNAIL_QUEUE", 100):
+            app.logger.info("Thumbnail queue full, picture %s is rendered on request", source_hash)
+            return
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=app.config.get("THUMBNAIL_WORKERS", 2), thread_name_prefix="thumbnails"
+            )
+        _pending.add(source_hash)
+    _pool.submit(_run, app, source_hash)
+
+
+def _run(app, source_hash):
+    try:
+        with app.app_context():
+            make_renditions(source_hash)
+    except Exception:
+        app.logger.exception("Thumbnails of picture %s failed", source_hash)
+    finally:
+        with _pool_lock:
+            _pending.discard(source_hash)
+
+
+def gallery_upload_options():
+    """Cloudinary upload options that have it render the WebP gallery renditions right away."""
+    return {
+        "eager": [{"crop": "limit", "width": size, "height": size, "format": "webp"} for size in RENDITION_SIZES],
+        "eager_async": True,
+    }
+
+
+def gallery_photo_url(photo_url, size):
+    """
+    URL of the smallest rendition of a Cloudinary gallery photo covering `size`,
+    in the best format the browser accepts. Other URLs are returned as they are.
+    """
+    if "/upload/" not in photo_url:
+        return photo_url
+    size = rendition_size(size)
+    transformation = cloudinary.utils.generate_transformation_string(
+        crop="limit", width=size, height=size, fetch_format="auto"
+    )[0]
+    return photo_url.replace("/upload/", f"/upload/{transformation}/", 1)
@@ -0,0 +1,116 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from core.imports import threading
+from core.extensions import db
+from core.savepoint import try_insert
+from core.models import LoveBasicInfo, UserPersonality, MatchPreference, TraitValue
+
+
+# Picklist fields are dictionary-encoded: every distinct value gets a row in
+# trait_values, and each model keeps an integer <field>_id next to the text.
+# The ids are set on write like birth_year and the signature, filled for
+# older rows by `flask upgrade-db`, and compared instead of the strings when
+# matching. This is about comparison cost, not storage: the text columns stay
+# for the API, so the ids add to each row until every reader has moved over.
+
+TRAIT_FIELDS = ["marital_status", "tribe", "skin_tone", "eye_colour", "body_type", "hair_colour", "religion", "education"]
+
+MODEL_TRAIT_FIELDS = {
+    LoveBasicInfo: ["marital_status", "tribe", "skin_tone"],
+    UserPersonality: ["eye_colour", "body_type", "hair_colour", "religion", "education"],
+    MatchPreference: TRAIT_FIELDS,
+}
+
+# (field, value) -> id for values known to be committed; ids never change
+_ids = {}
+_ids_lock = threading.Lock()
+
+
+def trait_column(model, field):
+    """The column matching reads for a field: its <field>_id when dictionary-encoded, else the text."""
+    if field in MODEL_TRAIT_FIELDS.get(model, ()):
+        return getattr(model, f"{field}_id")
+    return getattr(model, field)
+
+
+def trait_value(row, field):
+    """What trait_column holds for a field on a loaded row."""
+    if field in MODEL_TRAIT_FIELDS.get(type(row), ()):
+        return getattr(row, f"{field}_id")
+    return getattr(row, field)
+
+
+def _lookup(connection, field, value):
+    return connection.execute(
+        db.select(TraitValue.id).where(TraitValue.field == field, TraitValue.value == value)
+    ).scalar()
+
+
+def trait_id(connection, field, value, created=None):
+    """
+    Id of a field's value, adding it to trait_values when new. Empty values have no id.
+
+    Ids made in a transaction are recorded in `created` and only shared with
+    other sessions once it commits.
+    """
+    if not value:
+        return None
+    key = (field, value)
+    with _ids_lock:
+        if key in _ids:
+            return _ids[key]
+    if created is not None and key in created:
+        return created[key]
+
+    value_id = _lookup(connection, field, value)
+    if value_id is None:
+        # New values are rare, so the id is read back whichever worker stored it
+        try_insert(connection, lambda: connection.execute(db.insert(TraitValue).values(field=field, value=value)))
+        value_id = _lookup(connection, field, value)
+    if created is not None:
+        created[key] = value_id
+    return value_id
+
+
+def set_trait_ids(mapper, connection, target):
+    session = object_session(target)
+    created = session.info.setdefault("trait_values", {}) if session is not None else None
+    for field in MODEL_TRAIT_FIELDS[type(target)]:
+        setattr(target, f"{field}_id", trait_id(connection, field, getattr(target, field), created))
+
+
+@event.listens_for(Session, "after_commit")
+def _share_trait_ids(session):
+    created = session.info.pop("trait_values", None)
+    if created:
+        with _ids_lock:
+            _ids.update(created)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_trait_ids(session, previous_transaction):
+    # Also on a savepoint rollback: ids made inside it are gone, the others are looked up again
+    session.info.pop("trait_values", None)
+
+
+for _model in MODEL_TRAIT_FIELDS:
+    event.listen(_model, "before_insert", set_trait_ids)
+    event.listen(_model, "before_update", set_trait_ids)
+
+
+def backfill_trait_ids(batch_size=500):
+    """Dictionary-encode the picklist fields of rows stored before the <field>_id columns existed."""
+    for model, fields in MODEL_TRAIT_FIELDS.items():
+        pending = db.or_(*[
+            db.and_(getattr(model, field).isnot(None), getattr(model, f"{field}_id").is_(None)) for field in fields
+        ])
+        last_id = 0
+        while True:
+            rows = model.query.filter(model.id > last_id, pending).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            connection = db.session.connection()
+            for row in rows:
+                set_trait_ids(None, connection, row)
+            last_id = rows[-1].id
+            db.session.commit()
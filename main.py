@@ -1,12 +1,23 @@
+import click
 from core.imports import ( base64,
     Flask, request, jsonify,
     JWTManager, get_jwt_identity, jwt_required,
     Swagger, load_dotenv,
-    datetime, timedelta, date, filetype, IntegrityError, SocketIO, emit
+    datetime, timedelta, date, IntegrityError, SocketIO, emit
 )
 from core.config import Config
 from core.extensions import db, jwt, mail, swagger, cors, bcrypt, oauth
 from core.models import User, TempUser, UserPersonality, MatchPreference, SavedPhoto, LoveBasicInfo, BusinessBasicInfo, BusinessCredentials
+from core.match_store import get_match_ranking, page_after, match_details, apply_scoring_weights
+from core.match_cache import match_cache
+from core.single_flight import single_flight
+from core.blob_store import blob_store, migrate_profile_pics, backfill_profile_pic_metadata
+from core.thumbnails import profile_pic_url, gallery_photo_url
+from core.match_jobs import enqueue_match_job, work
+from core.matching import trait_tokens, get_scoring_plan, init_scoring_plan, backfill_trait_tokens, backfill_preference_signatures, backfill_derived_fields
+from core.traits import backfill_trait_ids
+from core.schema import upgrade_schema
+from core.geo import Area
 from routes.auth_routes import auth_bp
 from routes.love import love_bp
 from routes.business import business_bp
@@ -14,6 +25,7 @@ from routes.connection import connection_bp
 from routes.blog import blog_bp
 from routes.gallery import gallery_bp
 from routes.calls import call_bp
+from routes.images import images_bp
 load_dotenv()
 
 socketio = SocketIO(cors_allowed_origins="*")
@@ -30,6 +42,10 @@ def create_app():
     bcrypt.init_app(app)
     oauth.init_app(app)
     socketio.init_app(app)
+    match_cache.init_app(app)
+    single_flight.init_app(app)
+    blob_store.init_app(app)
+    init_scoring_plan(app)
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(love_bp)
@@ -38,6 +54,7 @@ def create_app():
     app.register_blueprint(blog_bp)
     app.register_blueprint(gallery_bp)
     app.register_blueprint(call_bp)
+    app.register_blueprint(images_bp)
     return app
 
 app = create_app()
@@ -50,241 +67,243 @@ def model_to_dict(model):
     """Helper to convert a SQLAlchemy model to a dict."""
     return {column.name: getattr(model, column.name) for column in model.__table__.columns}
 
-def seed_love_users():
-    """Prepopulate the database with 5 users and their related info, including preferences."""
-    users_data = [
-        {
-            "email": "alice@example.com",
-            "phone": "1234567890",
-            "username": "alice123",
-            "account_type": "love",
-            "love_basic_info": {
-                "nickname": "Alice",
-                "fullname": "Alice Johnson",
-                "date_of_birth": date(1995, 5, 20),
-                "age_range": "25-30",
-                "marital_status": "Single",
-                "country_of_origin": "USA",
-                "tribe": "Navajo",
-                "current_location": "New York",
-                "skin_tone": "Fair"
-            },
-            "personality": {
-                "height": "5'6",
-                "eye_colour": "Blue",
-                "body_type": "Slim",
-                "hair_colour": "Blonde",
-                "hair_style": "Straight",
-                "interest": "travel, cooking, reading",
-                "hobbies": "yoga, hiking",
-                "music": "pop, jazz",
-                "movies": "romance, drama",
-                "activities": "dancing, volunteering",
-                "personality": "extrovert, kind",
-                "religion": "Christianity",
-                "education": "Bachelor's",
-                "languages": "English, Spanish",
-                "values": "family, honesty"
-            },
-            "matchpreference": {
-                "age_range": "27-35",
-                "marital_status": "Single",
-                "country_of_origin": "USA",
-                "current_location": "USA",
-                "body_type": "Athletic",
-                "religion": "Christianity",
-                "education": "Bachelor's or higher",
-                "languages": "English",
-                "values": "family, honesty, ambition"
-            }
+# Demo love accounts, also the trait vocabulary for benchmarks/match_benchmark.py
+LOVE_SEED_USERS = [
+    {
+        "email": "alice@example.com",
+        "phone": "1234567890",
+        "username": "alice123",
+        "account_type": "love",
+        "love_basic_info": {
+            "nickname": "Alice",
+            "fullname": "Alice Johnson",
+            "date_of_birth": date(1995, 5, 20),
+            "age_range": "25-30",
+            "marital_status": "Single",
+            "country_of_origin": "USA",
+            "tribe": "Navajo",
+            "current_location": "New York",
+            "skin_tone": "Fair"
         },
-        {
-            "email": "bob@example.com",
-            "phone": "9876543210",
-            "username": "bobster",
-            "account_type": "love",
-            "love_basic_info": {
-                "nickname": "Bob",
-                "fullname": "Bob Williams",
-                "date_of_birth": date(1990, 8, 10),
-                "age_range": "30-35",
-                "marital_status": "Single",
-                "country_of_origin": "Canada",
-                "tribe": "Cree",
-                "current_location": "Toronto",
-                "skin_tone": "Medium"
-            },
-            "personality": {
-                "height": "5'10",
-                "eye_colour": "Brown",
-                "body_type": "Athletic",
-                "hair_colour": "Black",
-                "hair_style": "Curly",
-                "interest": "sports, travel, photography",
-                "hobbies": "cycling, basketball",
-                "music": "rock, hip-hop",
-                "movies": "action, comedy",
-                "activities": "gym, concerts",
-                "personality": "adventurous, funny",
-                "religion": "Islam",
-                "education": "Master's",
-                "languages": "English, French",
-                "values": "loyalty, ambition"
-            },
-            "matchpreference": {
-                "age_range": "25-32",
-                "marital_status": "Single",
-                "country_of_origin": "Canada",
-                "current_location": "Toronto",
-                "body_type": "Slim or Athletic",
-                "religion": "Islam",
-                "education": "Bachelor's or higher",
-                "languages": "English, French",
-                "values": "loyalty, family"
-            }
+        "personality": {
+            "height": "5'6",
+            "eye_colour": "Blue",
+            "body_type": "Slim",
+            "hair_colour": "Blonde",
+            "hair_style": "Straight",
+            "interest": "travel, cooking, reading",
+            "hobbies": "yoga, hiking",
+            "music": "pop, jazz",
+            "movies": "romance, drama",
+            "activities": "dancing, volunteering",
+            "personality": "extrovert, kind",
+            "religion": "Christianity",
+            "education": "Bachelor's",
+            "languages": "English, Spanish",
+            "values": "family, honesty"
         },
-        {
-            "email": "charlie@example.com",
-            "phone": "5551112222",
-            "username": "charlie_x",
-            "account_type": "love",
-            "love_basic_info": {
-                "nickname": "Charlie",
-                "fullname": "Charlie Kim",
-                "date_of_birth": date(1993, 3, 15),
-                "age_range": "25-30",
-                "marital_status": "Divorced",
-                "country_of_origin": "South Korea",
-                "tribe": "None",
-                "current_location": "Seoul",
-                "skin_tone": "Light"
-            },
-            "personality": {
-                "height": "5'8",
-                "eye_colour": "Black",
-                "body_type": "Average",
-                "hair_colour": "Brown",
-                "hair_style": "Wavy",
-                "interest": "gaming, anime, technology",
-                "hobbies": "coding, chess",
-                "music": "kpop, edm",
-                "movies": "sci-fi, thriller",
-                "activities": "esports, hiking",
-                "personality": "introvert, thoughtful",
-                "religion": "Buddhism",
-                "education": "Bachelor's",
-                "languages": "Korean, English",
-                "values": "respect, discipline"
-            },
-            "matchpreference": {
-                "age_range": "23-29",
-                "marital_status": "Single or Divorced",
-                "country_of_origin": "South Korea",
-                "current_location": "Seoul",
-                "body_type": "Slim or Average",
-                "religion": "Buddhism or None",
-                "education": "Any",
-                "languages": "Korean, English",
-                "values": "kindness, respect"
-            }
+        "matchpreference": {
+            "age_range": "27-35",
+            "marital_status": "Single",
+            "country_of_origin": "USA",
+            "current_location": "USA",
+            "body_type": "Athletic",
+            "religion": "Christianity",
+            "education": "Bachelor's or higher",
+            "languages": "English",
+            "values": "family, honesty, ambition"
+        }
+    },
+    {
+        "email": "bob@example.com",
+        "phone": "9876543210",
+        "username": "bobster",
+        "account_type": "love",
+        "love_basic_info": {
+            "nickname": "Bob",
+            "fullname": "Bob Williams",
+            "date_of_birth": date(1990, 8, 10),
+            "age_range": "30-35",
+            "marital_status": "Single",
+            "country_of_origin": "Canada",
+            "tribe": "Cree",
+            "current_location": "Toronto",
+            "skin_tone": "Medium"
         },
-        {
-            "email": "diana@example.com",
-            "phone": "4449998888",
-            "username": "diana_queen",
-            "account_type": "love",
-            "love_basic_info": {
-                "nickname": "Diana",
-                "fullname": "Diana Prince",
-                "date_of_birth": date(1998, 11, 25),
-                "age_range": "20-25",
-                "marital_status": "Single",
-                "country_of_origin": "UK",
-                "tribe": "None",
-                "current_location": "London",
-                "skin_tone": "Olive"
-            },
-            "personality": {
-                "height": "5'7",
-                "eye_colour": "Green",
-                "body_type": "Slim",
-                "hair_colour": "Red",
-                "hair_style": "Straight",
-                "interest": "fashion, arts, travel",
-                "hobbies": "painting, blogging",
-                "music": "indie, pop",
-                "movies": "romantic comedy, fantasy",
-                "activities": "museum visits, cooking",
-                "personality": "creative, caring",
-                "religion": "Christianity",
-                "education": "Bachelor's",
-                "languages": "English, Italian",
-                "values": "kindness, creativity"
-            },
-            "matchpreference": {
-                "age_range": "25-32",
-                "marital_status": "Single",
-                "country_of_origin": "UK or Europe",
-                "current_location": "London",
-                "body_type": "Athletic or Slim",
-                "religion": "Christianity",
-                "education": "Bachelor's or higher",
-                "languages": "English",
-                "values": "creativity, kindness"
-            }
+        "personality": {
+            "height": "5'10",
+            "eye_colour": "Brown",
+            "body_type": "Athletic",
+            "hair_colour": "Black",
+            "hair_style": "Curly",
+            "interest": "sports, travel, photography",
+            "hobbies": "cycling, basketball",
+            "music": "rock, hip-hop",
+            "movies": "action, comedy",
+            "activities": "gym, concerts",
+            "personality": "adventurous, funny",
+            "religion": "Islam",
+            "education": "Master's",
+            "languages": "English, French",
+            "values": "loyalty, ambition"
         },
-        {
-            "email": "eric@example.com",
-            "phone": "2227776666",
-            "username": "eric_the_great",
-            "account_type": "love",
-            "love_basic_info": {
-                "nickname": "Eric",
-                "fullname": "Eric Johnson",
-                "date_of_birth": date(1992, 6, 5),
-                "age_range": "30-35",
-                "marital_status": "Single",
-                "country_of_origin": "USA",
-                "tribe": "Cherokee",
-                "current_location": "Los Angeles",
-                "skin_tone": "Dark"
-            },
-            "personality": {
-                "height": "6'0",
-                "eye_colour": "Hazel",
-                "body_type": "Muscular",
-                "hair_colour": "Black",
-                "hair_style": "Buzzcut",
-                "interest": "fitness, business, travel",
-                "hobbies": "gym, investing",
-                "music": "hip-hop, r&b",
-                "movies": "thriller, documentary",
-                "activities": "networking, basketball",
-                "personality": "confident, driven",
-                "religion": "Atheist",
-                "education": "MBA",
-                "languages": "English, Spanish",
-                "values": "success, honesty"
-            },
-            "matchpreference": {
-                "age_range": "25-32",
-                "marital_status": "Single",
-                "country_of_origin": "USA",
-                "current_location": "Los Angeles",
-                "body_type": "Slim or Athletic",
-                "religion": "Any",
-                "education": "Bachelor's or higher",
-                "languages": "English",
-                "values": "confidence, honesty"
-            }
+        "matchpreference": {
+            "age_range": "25-32",
+            "marital_status": "Single",
+            "country_of_origin": "Canada",
+            "current_location": "Toronto",
+            "body_type": "Slim or Athletic",
+            "religion": "Islam",
+            "education": "Bachelor's or higher",
+            "languages": "English, French",
+            "values": "loyalty, family"
+        }
+    },
+    {
+        "email": "charlie@example.com",
+        "phone": "5551112222",
+        "username": "charlie_x",
+        "account_type": "love",
+        "love_basic_info": {
+            "nickname": "Charlie",
+            "fullname": "Charlie Kim",
+            "date_of_birth": date(1993, 3, 15),
+            "age_range": "25-30",
+            "marital_status": "Divorced",
+            "country_of_origin": "South Korea",
+            "tribe": "None",
+            "current_location": "Seoul",
+            "skin_tone": "Light"
         },
-    ]
+        "personality": {
+            "height": "5'8",
+            "eye_colour": "Black",
+            "body_type": "Average",
+            "hair_colour": "Brown",
+            "hair_style": "Wavy",
+            "interest": "gaming, anime, technology",
+            "hobbies": "coding, chess",
+            "music": "kpop, edm",
+            "movies": "sci-fi, thriller",
+            "activities": "esports, hiking",
+            "personality": "introvert, thoughtful",
+            "religion": "Buddhism",
+            "education": "Bachelor's",
+            "languages": "Korean, English",
+            "values": "respect, discipline"
+        },
+        "matchpreference": {
+            "age_range": "23-29",
+            "marital_status": "Single or Divorced",
+            "country_of_origin": "South Korea",
+            "current_location": "Seoul",
+            "body_type": "Slim or Average",
+            "religion": "Buddhism or None",
+            "education": "Any",
+            "languages": "Korean, English",
+            "values": "kindness, respect"
+        }
+    },
+    {
+        "email": "diana@example.com",
+        "phone": "4449998888",
+        "username": "diana_queen",
+        "account_type": "love",
+        "love_basic_info": {
+            "nickname": "Diana",
+            "fullname": "Diana Prince",
+            "date_of_birth": date(1998, 11, 25),
+            "age_range": "20-25",
+            "marital_status": "Single",
+            "country_of_origin": "UK",
+            "tribe": "None",
+            "current_location": "London",
+            "skin_tone": "Olive"
+        },
+        "personality": {
+            "height": "5'7",
+            "eye_colour": "Green",
+            "body_type": "Slim",
+            "hair_colour": "Red",
+            "hair_style": "Straight",
+            "interest": "fashion, arts, travel",
+            "hobbies": "painting, blogging",
+            "music": "indie, pop",
+            "movies": "romantic comedy, fantasy",
+            "activities": "museum visits, cooking",
+            "personality": "creative, caring",
+            "religion": "Christianity",
+            "education": "Bachelor's",
+            "languages": "English, Italian",
+            "values": "kindness, creativity"
+        },
+        "matchpreference": {
+            "age_range": "25-32",
+            "marital_status": "Single",
+            "country_of_origin": "UK or Europe",
+            "current_location": "London",
+            "body_type": "Athletic or Slim",
+            "religion": "Christianity",
+            "education": "Bachelor's or higher",
+            "languages": "English",
+            "values": "creativity, kindness"
+        }
+    },
+    {
+        "email": "eric@example.com",
+        "phone": "2227776666",
+        "username": "eric_the_great",
+        "account_type": "love",
+        "love_basic_info": {
+            "nickname": "Eric",
+            "fullname": "Eric Johnson",
+            "date_of_birth": date(1992, 6, 5),
+            "age_range": "30-35",
+            "marital_status": "Single",
+            "country_of_origin": "USA",
+            "tribe": "Cherokee",
+            "current_location": "Los Angeles",
+            "skin_tone": "Dark"
+        },
+        "personality": {
+            "height": "6'0",
+            "eye_colour": "Hazel",
+            "body_type": "Muscular",
+            "hair_colour": "Black",
+            "hair_style": "Buzzcut",
+            "interest": "fitness, business, travel",
+            "hobbies": "gym, investing",
+            "music": "hip-hop, r&b",
+            "movies": "thriller, documentary",
+            "activities": "networking, basketball",
+            "personality": "confident, driven",
+            "religion": "Atheist",
+            "education": "MBA",
+            "languages": "English, Spanish",
+            "values": "success, honesty"
+        },
+        "matchpreference": {
+            "age_range": "25-32",
+            "marital_status": "Single",
+            "country_of_origin": "USA",
+            "current_location": "Los Angeles",
+            "body_type": "Slim or Athletic",
+            "religion": "Any",
+            "education": "Bachelor's or higher",
+            "languages": "English",
+            "values": "confidence, honesty"
+        }
+    },
+]
 
+
+def seed_love_users():
+    """Prepopulate the database with 5 users and their related info, including preferences."""
     raw_password = "password123"
     hashed_password = bcrypt.generate_password_hash(raw_password).decode('utf-8')
 
     created_count = 0
-    for data in users_data:
+    for data in LOVE_SEED_USERS:
         existing = User.query.filter_by(email=data["email"]).first()
         if existing:
             print(f"⚠️ User with email {data['email']} already exists, skipping.")
@@ -439,58 +458,31 @@ def seed_business_users():
 
 def calculate_match_score(preferences, user, personality):
     score = 0
+    plan = get_scoring_plan()
 
-    # 1. Exact matches for simple fields
-    if preferences.age_range and preferences.age_range == user.love_basic_info.age_range:
-        score += 5
-    if preferences.marital_status and preferences.marital_status == user.love_basic_info.marital_status:
-        score += 5
-    if preferences.country_of_origin and preferences.country_of_origin == user.love_basic_info.country_of_origin:
-        score += 5
-    if preferences.tribe and preferences.tribe == user.love_basic_info.tribe:
-        score += 5
-    if preferences.skin_tone and preferences.skin_tone == user.love_basic_info.skin_tone:
-        score += 5
-
-    if preferences.height and preferences.height == personality.height:
-        score += 5
-    if preferences.eye_colour and preferences.eye_colour == personality.eye_colour:
-        score += 5
-    if preferences.body_type and preferences.body_type == personality.body_type:
-        score += 5
-    if preferences.hair_colour and preferences.hair_colour == personality.hair_colour:
-        score += 5
-    if preferences.hair_style and preferences.hair_style == personality.hair_style:
-        score += 5
-    if preferences.religion and preferences.religion == personality.religion:
-        score += 5
-    if preferences.education and preferences.education == personality.education:
-        score += 5
-    if preferences.languages and preferences.languages == personality.languages:
-        score += 5
-
-    # 2. Multi-value list fields
-    def overlap_score(pref_string, user_string, weight):
-        """Compare comma-separated lists and return partial weight based on overlap"""
-        if not pref_string or not user_string:
-            return 0
-        pref_set = {s.strip().lower() for s in pref_string.split(',') if s.strip()}
-        user_set = {s.strip().lower() for s in user_string.split(',') if s.strip()}
-        overlap = pref_set & user_set
+    # 1. Exact matches for simple fields, worth their MATCH_WEIGHTS points
+    for model, field, weight in plan.exact_terms:
+        wanted = getattr(preferences, field)
+        if wanted and wanted == getattr(user.love_basic_info if model is LoveBasicInfo else personality, field):
+            score += weight
+
+    # 2. Multi-value list fields, already split into tokens when the rows were saved
+    pref_tokens = trait_tokens(preferences)
+    user_tokens = trait_tokens(personality)
+
+    def overlap_score(field, weight):
+        """Return partial weight based on how many preferred tokens the user has"""
+        pref_set = pref_tokens[field]
         if not pref_set:
             return 0
+        overlap = pref_set & user_tokens[field]
         return (len(overlap) / len(pref_set)) * weight
 
     # Compare interests, hobbies, etc.
-    score += overlap_score(preferences.interest, personality.interest, 5)
-    score += overlap_score(preferences.hobbies, personality.hobbies, 5)
-    score += overlap_score(preferences.movies, personality.movies, 5)
-    score += overlap_score(preferences.music, personality.music, 5)
-    score += overlap_score(preferences.activities, personality.activities, 5)
-    score += overlap_score(preferences.values, personality.values, 5)
-    score += overlap_score(preferences.personality, personality.personality, 5)
+    for field, weight in plan.list_terms:
+        score += overlap_score(field, weight)
 
-    return score  # Total max: 100
+    return score  # Total max: 100 with the default weights
 
 
 @app.route('/matches', methods=['GET'])
@@ -499,8 +491,15 @@ def get_matches():
     """
     Get matches for the current logged-in user.
 
-    This endpoint returns a list of potential matches for the current user
-    based on their saved preferences.
+    This endpoint returns the best potential matches for the current user
+    based on their saved preferences, highest score first. Candidates that
+    share nothing with the preferences are not returned. Results come a page
+    of `limit` at a time; when more follow, the X-Next-Cursor header holds the
+    cursor for the next page, which is cut from the same ranking. radius_km
+    (around the user's current location) and region (a country code such as
+    NG) keep only candidates from that area, and only those are scored. With
+    mode=reciprocal the score is the harmonic mean of how well the candidate
+    fits the user's preferences and how well the user fits the candidate's.
 
     ---
     tags:
@@ -515,9 +514,49 @@ def get_matches():
         schema:
           type: string
           example: "Bearer eyJhbGciOiJIUzI1NiIsInR5cCI6..."
+      - name: limit
+        in: query
+        description: Maximum number of matches per page
+        required: false
+        schema:
+          type: integer
+          example: 50
+      - name: mode
+        in: query
+        description: one_way ranks by the user's preferences only, reciprocal by fit in both directions
+        required: false
+        schema:
+          type: string
+          enum: [one_way, reciprocal]
+          example: reciprocal
+      - name: cursor
+        in: query
+        description: X-Next-Cursor value from the previous page
+        required: false
+        schema:
+          type: string
+      - name: radius_km
+        in: query
+        description: Only candidates within this distance of the user's current location
+        required: false
+        schema:
+          type: number
+          example: 50
+      - name: region
+        in: query
+        description: Only candidates whose current location is in this country (ISO code)
+        required: false
+        schema:
+          type: string
+          example: NG
     responses:
       200:
-        description: A list of matches
+        description: A page of matches
+        headers:
+          X-Next-Cursor:
+            description: Cursor for the next page, absent on the last page
+            schema:
+              type: string
         content:
           application/json:
             schema:
@@ -536,56 +575,103 @@ def get_matches():
                     example: 90
                   profile_pic:
                     type: string
-                    example: "data:image/jpeg;base64,..."
+                    example: "/api/images/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08?size=256"
       400:
-        description: Preferences not set
+        description: Preferences not set, profile or location missing, unknown mode, invalid cursor or radius
       404:
         description: User not found
     """
     current_user_id = get_jwt_identity()
+    limit = request.args.get("limit", app.config["MATCHES_TOP_K"], type=int)
+    limit = max(1, min(limit, app.config["MATCHES_MAX_K"]))
+    mode = request.args.get("mode", app.config["MATCH_RANKING_MODE"])
+    if mode not in ("one_way", "reciprocal"):
+        return jsonify({"message": "mode must be one_way or reciprocal"}), 400
+
+    cursor = request.args.get("cursor")
+    after = decode_match_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    radius_km = request.args.get("radius_km", type=float)
+    region = (request.args.get("region") or "").strip().upper() or None
+    if radius_km is not None and not 0 < radius_km <= app.config["MATCH_MAX_RADIUS_KM"]:
+        return jsonify({"message": f"radius_km must be between 0 and {app.config['MATCH_MAX_RADIUS_KM']:g}"}), 400
+
+    cache_key = f"{mode}:{limit}:{cursor or ''}:{radius_km}:{region}"
+    cached = match_cache.get(current_user_id, cache_key)
+    if cached is not None:
+        return matches_response(cached)
+
+    # Identical requests arriving together wait for one computation
+    result, status = single_flight.do(
+        ("matches", current_user_id, cache_key),
+        lambda: build_matches_page(current_user_id, mode, limit, after, radius_km, region, cache_key)
+    )
+    if status != 200:
+        return jsonify(result), status
+    return matches_response(result)
+
+
+def build_matches_page(current_user_id, mode, limit, after, radius_km, region, cache_key):
+    """One /matches page as (result, 200), or ({"message": ...}, status) when it cannot be built."""
     user = User.query.get(current_user_id)
 
     if not user:
-        return jsonify({"message": "User not found"}), 404
+        return {"message": "User not found"}, 404
 
     preferences = MatchPreference.query.filter_by(user_id=current_user_id).first()
     if not preferences:
-        return jsonify({"message": "Preferences not set"}), 400
+        return {"message": "Preferences not set"}, 400
 
-    candidates = User.query.filter(
-        User.id != current_user_id,
-        User.account_type == user.account_type
-    ).all()
+    if mode == "reciprocal" and (not user.love_basic_info or not user.personality):
+        return {"message": "Profile not set"}, 400
 
-    matches = []
-    for candidate in candidates:
-        if not candidate.love_basic_info or not candidate.personality:
-            continue
+    area = None
+    if radius_km is not None or region:
+        info = user.love_basic_info
+        if radius_km is not None and (not info or info.latitude is None):
+            return {"message": "Current location not set or not recognised"}, 400
+        area = Area(info.latitude if info else None, info.longitude if info else None, radius_km, region)
 
-        score = calculate_match_score(preferences, candidate, candidate.personality)
-
-        profile_pic_data = None
-        if candidate.profile_pic:
-            try:
-                image_bytes = base64.b64decode(candidate.profile_pic)
-                kind = filetype.guess(image_bytes)
-                extension = kind.extension if kind else "jpeg"
-                mime_type = f"image/{extension}" if extension in ['jpeg', 'png'] else "image/jpeg"
-                profile_pic_data = f"data:{mime_type};base64,{candidate.profile_pic}"
-            except Exception:
-                profile_pic_data = None
+    page, has_more = page_after(get_match_ranking(user, mode, area), after, limit)
 
+    matches = []
+    for candidate_id, score, nickname, profile_pic_hash in match_details(page):
         matches.append({
-            "user_id": candidate.id,
-            "nickname": candidate.love_basic_info.nickname,
+            "user_id": candidate_id,
+            "nickname": nickname,
             "score": int(score),
-            "profile_pic": profile_pic_data
+            "profile_pic": profile_pic_url(profile_pic_hash, size=256)
         })
 
-    # Sort so highest score is first
-    matches.sort(key=lambda m: m['score'], reverse=True)
+    result = {
+        "matches": matches,
+        "next_cursor": encode_match_cursor(*reversed(page[-1])) if has_more and page else None
+    }
+    match_cache.set(current_user_id, cache_key, result)
+    return result, 200
+
+
+def encode_match_cursor(score, user_id):
+    """Opaque cursor for the position of one (score, user_id) entry in a ranking."""
+    return base64.urlsafe_b64encode(f"{int(score)}:{int(user_id)}".encode()).decode()
+
+
+def decode_match_cursor(cursor):
+    """Return the (score, user_id) pair inside a cursor, or None if it is not one of ours."""
+    try:
+        score, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(score), int(user_id)
+    except (ValueError, UnicodeError):
+        return None
 
-    return jsonify(matches), 200
+
+def matches_response(result):
+    response = jsonify(result["matches"])
+    if result["next_cursor"]:
+        response.headers["X-Next-Cursor"] = result["next_cursor"]
+    return response, 200
 
 
 @app.route('/match/account/<int:user_id>', methods=['GET'])
@@ -625,7 +711,7 @@ def get_match_account(user_id):
                   type: string
                 profile_pic:
                   type: string
-                  description: Base64-encoded profile picture (with MIME type prefix) or null
+                  description: URL of the profile picture, or null
                 gallery_photos:
                   type: array
                   items:
@@ -685,7 +771,13 @@ def get_match_account(user_id):
       404:
         description: User not found
     """
-    user = User.query.get(user_id)
+    user = User.query.options(
+        db.joinedload(User.love_basic_info),
+        db.joinedload(User.personality).undefer_group("personality_lists"),
+        db.lazyload(User.matchpreference),
+        db.lazyload(User.business_basic_info),
+        db.lazyload(User.business_credentials)
+    ).get(user_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -694,19 +786,10 @@ def get_match_account(user_id):
     personality = user.personality
 
     # Process profile picture
-    profile_pic_data = None
-    if user.profile_pic:
-        try:
-            image_bytes = base64.b64decode(user.profile_pic)
-            kind = filetype.guess(image_bytes)
-            extension = kind.extension if kind else "jpeg"
-            mime_type = f"image/{extension}" if extension in ["jpeg", "png"] else "image/jpeg"
-            profile_pic_data = f"data:{mime_type};base64,{user.profile_pic}"
-        except Exception:
-            profile_pic_data = None
+    profile_pic_data = profile_pic_url(user.profile_pic_hash, size=1024)
 
     saved_photos = SavedPhoto.query.filter_by(user_id=user_id).order_by(SavedPhoto.uploaded_at.desc()).all()
-    gallery_photos = [photo.photo_url for photo in saved_photos]
+    gallery_photos = [gallery_photo_url(photo.photo_url, size=1024) for photo in saved_photos]
 
     user_data = {
         "user_id": user.id,
@@ -818,7 +901,7 @@ def show_users():
               items:
                 type: object
     """
-    users = User.query.all()
+    users = User.query.options(db.lazyload("*")).all()
     return jsonify([model_to_dict(user) for user in users])
 
 @app.route('/show_love_users')
@@ -840,7 +923,7 @@ def show_love_users():
                 type: object
     """
     #users = User.query.filter(User.love_basic_info.isnot(None)).all()
-    users = User.query.filter(User.account_type == "love").all()
+    users = User.query.options(db.lazyload("*")).filter(User.account_type == "love").all()
     return jsonify([model_to_dict(user) for user in users])
 
 @app.route('/show_business_users')
@@ -862,13 +945,13 @@ def show_business_users():
                 type: object
     """
     #users = User.query.filter(User.business_basic_info.isnot(None)).all()
-    users = User.query.filter(User.account_type == "business").all()
+    users = User.query.options(db.lazyload("*")).filter(User.account_type == "business").all()
     return jsonify([model_to_dict(user) for user in users])
 
 
 @app.route('/show_preferences')
 def show_preferences():
-    preferences = UserPersonality.query.all()
+    preferences = UserPersonality.query.options(db.undefer_group("personality_lists")).all()
     return jsonify([model_to_dict(pref) for pref in preferences])
 
 
@@ -885,6 +968,32 @@ def show_users_and_preferences():
     return jsonify(result)
 
 
+@app.cli.command("upgrade-db")
+def upgrade_db():
+    """Create new tables, add new columns to existing ones, backfill derived data and apply MATCH_WEIGHTS changes."""
+    upgrade_schema()
+    migrate_profile_pics()
+    backfill_profile_pic_metadata()
+    backfill_trait_tokens()
+    backfill_preference_signatures()
+    backfill_derived_fields()
+    backfill_trait_ids()
+    apply_scoring_weights()
+    print("Database upgraded.")
+
+
+@app.cli.command("match-worker")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+@click.option("--rebuild", metavar="ACCOUNT_TYPE", help='Queue a rebuild of an account type\'s stored lists first ("all" for every type).')
+def match_worker(once, rebuild):
+    """Run queued match jobs (user updates, signature recomputes, full rebuilds)."""
+    app.config["MATCH_BACKGROUND_UPDATES"] = False  # this process is the worker
+    if rebuild:
+        enqueue_match_job("rebuild", account_type=None if rebuild == "all" else rebuild)
+        db.session.commit()
+    work(once=once, reset_pools=True)
+
+
 def prepopulate_temp_users():
     # Prevent duplicate inserts
     if TempUser.query.first():
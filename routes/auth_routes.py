@@ -1,12 +1,16 @@
 from core.imports import (
     request, jsonify, Message,
     create_access_token, JWTManager, get_jwt_identity, jwt_required, render_template,
-    datetime, timedelta, random, Client, Blueprint, base64, io, np, Image, cv2, redirect, string, url_for, os, load_dotenv, filetype
+    datetime, timedelta, random, Client, Blueprint, base64, io, np, Image, cv2, redirect, string, url_for, os, load_dotenv
 )
 from flask import Flask
 from core.config import Config
 from core.extensions import db, mail, bcrypt, oauth
 from core.models import User, TempUser, Connection, Message as ChatMessage
+from core.blob_store import set_profile_pic
+from core.match_jobs import enqueue_match_job
+from core.match_store import signature_in_use
+from core.thumbnails import profile_pic_url, gallery_photo_url, schedule_renditions
 from authlib.integrations.flask_client import OAuth
 import cloudinary.uploader
 
@@ -385,7 +389,8 @@ def verify_face():
 
     try:
         image_data = base64.b64decode(face_image_b64)
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
+        source = Image.open(io.BytesIO(image_data))
+        image = source.convert('RGB')
         image_np = np.array(image)
 
         # Load OpenCV's built-in face detector
@@ -399,13 +404,14 @@ def verify_face():
             return jsonify({"error": "No face detected"}), 400
         
 
-         # Save Base64 image string to user's profile
+        # Save the image bytes to the blob store, the profile keeps their hash and metadata
         user = User.query.get(user_id)
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        user.profile_pic = face_image_b64
+        set_profile_pic(user, image_data, source)
         db.session.commit()
+        schedule_renditions(user.profile_pic_hash)
 
         return jsonify({"message": f"{len(faces)} face(s) detected and saved"}), 200
 
@@ -508,7 +514,7 @@ def get_user_profile():
               type: string
             profile_pic:
               type: string
-              description: Base64 encoded image with MIME type prefix
+              description: URL of the profile picture, or null
             personal_profile:
               type: object
               properties:
@@ -556,25 +562,14 @@ def get_user_profile():
     user = User.query.options(
         db.joinedload(User.love_basic_info),
         db.joinedload(User.business_basic_info),
-        db.joinedload(User.business_credentials),
-        db.joinedload(User.personality),
-        db.joinedload(User.matchpreference)
+        db.joinedload(User.business_credentials).undefer_group("credentials_text"),
+        db.joinedload(User.personality).undefer_group("personality_lists"),
+        db.lazyload(User.matchpreference)
     ).get(current_user_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    # Image handling
-    mime_type = "image/jpeg"
-    if user.profile_pic:
-        try:
-            image_bytes = base64.b64decode(user.profile_pic)
-            kind = filetype.guess(image_bytes)
-            if kind:
-                mime_type = f"image/{kind.extension}"
-        except Exception:
-            pass
-
     love = user.love_basic_info
     biz = user.business_basic_info
     cred = user.business_credentials
@@ -586,7 +581,7 @@ def get_user_profile():
         "phone": user.phone,
         "username": user.username,
         "account_type": user.account_type,
-        "profile_pic": f"data:{mime_type};base64,{user.profile_pic}" if user.profile_pic else None,
+        "profile_pic": profile_pic_url(user.profile_pic_hash, size=1024),
         "personal_profile": {
             "fullname": love.fullname if love else None,
             "nickname": love.nickname if love else None,
@@ -619,7 +614,7 @@ def get_user_profile():
             "religion": pers.religion if pers else None,
             "education": pers.education if pers else None,
         },
-        "photos": [photo.photo_url for photo in user.saved_images]
+        "photos": [gallery_photo_url(photo.photo_url, size=1024) for photo in user.saved_images]
     }
 
     return jsonify(user_data), 200
@@ -836,7 +831,12 @@ def delete_account():
         if user.personality:
             db.session.delete(user.personality)
         if user.matchpreference:
+            signature = user.matchpreference.signature
             db.session.delete(user.matchpreference)
+            db.session.flush()
+            if signature and user.account_type and not signature_in_use(signature):
+                # Nobody has these preferences anymore, the job drops their list
+                enqueue_match_job("signature", account_type=user.account_type, signature=signature)
 
         # --- Business account related ---
         if user.business_basic_info:
@@ -1,11 +1,13 @@
 from core.imports import (
     request, jsonify, Message,
     JWTManager, get_jwt_identity, jwt_required,
-    datetime, timedelta, Blueprint, redirect, load_dotenv, filetype, base64
+    datetime, timedelta, Blueprint, redirect, load_dotenv
 )
 from core.config import Config
 import cloudinary.uploader
 from core.extensions import db
+from core.single_flight import single_flight
+from core.thumbnails import profile_pic_url, gallery_photo_url
 from core.models import User, BusinessBasicInfo, BusinessCredentials, SavedPhoto, Message, BusinessAnonymous
 
 
@@ -376,7 +378,9 @@ def update_business_credentials():
     if not user:
         return jsonify({"message": "User not found"}), 404
 
-    credentials = BusinessCredentials.query.filter_by(user_id=current_user_id).first()
+    credentials = BusinessCredentials.query.options(
+        db.undefer_group("credentials_text")
+    ).filter_by(user_id=current_user_id).first()
     if not credentials:
         return jsonify({"message": "Credentials not found. Use POST to create."}), 404
 
@@ -690,7 +694,18 @@ def get_users_with_business():
       401:
         description: Unauthorized - Missing or invalid JWT
     """
-    users = User.query.join(BusinessBasicInfo).all()
+    # The list is the same for every caller, so concurrent requests build it once
+    return jsonify(single_flight.do(("business_homepage",), business_homepage)), 200
+
+
+def business_homepage():
+    users = User.query.join(BusinessBasicInfo).options(
+        db.joinedload(User.business_credentials).undefer_group("credentials_text"),
+        db.selectinload(User.saved_images),
+        db.lazyload(User.love_basic_info),
+        db.lazyload(User.personality),
+        db.lazyload(User.matchpreference)
+    ).all()
 
     result = []
     for user in users:
@@ -720,11 +735,11 @@ def get_users_with_business():
                     "skills": user.business_credentials.skills if user.business_credentials else None,
                     "description": user.business_credentials.description if user.business_credentials else None,
                     "businessInterests": user.business_credentials.businessInterests if user.business_credentials else None,
-                "photos": [photo.photo_url for photo in user.saved_images] if user.saved_images else [],
+                "photos": [gallery_photo_url(photo.photo_url, size=256) for photo in user.saved_images] if user.saved_images else [],
             }
         )
 
-    return jsonify(result), 200
+    return result
 
 
 @business_bp.route('/api/business/user/<int:user_id>', methods=['GET'])
@@ -752,9 +767,10 @@ def get_single_user_detail(user_id):
     # Fetch user with all related tables joined to avoid multiple queries
     user = User.query.options(
         db.joinedload(User.business_basic_info),
-        db.joinedload(User.business_credentials),
+        db.joinedload(User.business_credentials).undefer_group("credentials_text"),
         db.joinedload(User.love_basic_info),
-        db.joinedload(User.personality),
+        db.joinedload(User.personality).undefer_group("personality_lists"),
+        db.lazyload(User.matchpreference),
         db.joinedload(User.saved_images)
     ).get(user_id)
 
@@ -768,19 +784,7 @@ def get_single_user_detail(user_id):
     p = user.personality
 
     # Profile Picture Handling (Consistency with your profile route)
-    mime_type = "image/jpeg"
-    profile_pic_data = None
-    if user.profile_pic:
-        try:
-            import base64
-            import filetype
-            image_bytes = base64.b64decode(user.profile_pic)
-            kind = filetype.guess(image_bytes)
-            if kind:
-                mime_type = f"image/{kind.extension}"
-            profile_pic_data = f"data:{mime_type};base64,{user.profile_pic}"
-        except Exception:
-            profile_pic_data = None
+    profile_pic_data = profile_pic_url(user.profile_pic_hash, size=1024)
 
     result = {
         "id": user.id,
@@ -832,7 +836,7 @@ def get_single_user_detail(user_id):
         } if p else None,
 
         # Media
-        "photos": [photo.photo_url for photo in user.saved_images]
+        "photos": [gallery_photo_url(photo.photo_url, size=1024) for photo in user.saved_images]
     }
 
     return jsonify(result), 200
@@ -880,7 +884,10 @@ def get_message_contacts():
         return jsonify({"love_contacts": [], "business_contacts": []}), 200
 
     # 3. Fetch all contact User objects
-    contacts = User.query.filter(User.id.in_(contact_ids)).all()
+    contacts = User.query.options(
+        db.load_only(User.id, User.username, User.email, User.profile_pic_hash, User.account_type),
+        db.lazyload("*")
+    ).filter(User.id.in_(contact_ids)).all()
 
     # 4. Initialize buckets
     result = {
@@ -890,15 +897,7 @@ def get_message_contacts():
 
     for user in contacts:
         # Profile Picture logic
-        profile_pic_data = None
-        if user.profile_pic:
-            try:
-                image_bytes = base64.b64decode(user.profile_pic)
-                kind = filetype.guess(image_bytes)
-                extension = kind.extension if kind else "jpeg"
-                profile_pic_data = f"data:image/{extension};base64,{user.profile_pic}"
-            except Exception:
-                profile_pic_data = None
+        profile_pic_data = profile_pic_url(user.profile_pic_hash, size=64)
 
         contact_data = {
             "id": user.id,
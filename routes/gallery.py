@@ -2,6 +2,7 @@ from core.imports import (request, re, jsonify, Blueprint, jwt_required, load_do
 import cloudinary.uploader
 from core.models import SavedPhoto, User
 from core.extensions import db
+from core.thumbnails import gallery_upload_options, gallery_photo_url
 
 gallery_bp = Blueprint('gallery', __name__)
 load_dotenv()
@@ -55,7 +56,8 @@ def upload_photo():
         return jsonify({'error': 'No file provided'}), 400
 
     try:
-        result = cloudinary.uploader.upload(file)
+        # Cloudinary renders the thumbnail sizes in the background
+        result = cloudinary.uploader.upload(file, **gallery_upload_options())
         url = result['secure_url']
         print("Photo uploaded to Cloudinary")
     except Exception as e:
@@ -105,6 +107,9 @@ def get_photos():
               url:
                 type: string
                 example: https://res.cloudinary.com/demo/image/upload/v12345678/sample.jpg
+              thumbnail_url:
+                type: string
+                example: https://res.cloudinary.com/demo/image/upload/c_limit,h_256,w_256/v12345678/sample.webp
               uploaded_at:
                 type: string
                 format: date-time
@@ -115,7 +120,12 @@ def get_photos():
     user_id = get_jwt_identity()
     photos = SavedPhoto.query.filter_by(user_id=user_id).all()
 
-    result = [{'id': p.id, 'url': p.photo_url, 'uploaded_at': p.uploaded_at.isoformat()} for p in photos]
+    result = [{
+        'id': p.id,
+        'url': p.photo_url,
+        'thumbnail_url': gallery_photo_url(p.photo_url, size=256),
+        'uploaded_at': p.uploaded_at.isoformat()
+    } for p in photos]
 
     return jsonify(result), 200
 
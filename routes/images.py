@@ -0,0 +1,112 @@
+from core.imports import (request, re, jsonify, Blueprint)
+from flask import current_app, send_file
+from core.blob_store import blob_store, image_mime_type, profile_pic_mime_type, is_profile_pic
+from core.thumbnails import RENDITION_FORMATS, RENDITION_MIME_TYPES, rendition_size, get_rendition
+
+images_bp = Blueprint('images', __name__)
+
+BLOB_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _cached(response, etag):
+    # Content never changes under a hash, so clients and proxies may keep it for good
+    response.set_etag(etag)
+    response.cache_control.no_cache = None  # send_file sets it when no max age is configured
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get("IMAGE_MAX_AGE", 31536000)
+    response.cache_control.immutable = True
+    return response
+
+
+def _not_modified(etag):
+    return _cached(current_app.response_class(status=304), etag)
+
+
+@images_bp.route('/api/images/<digest>', methods=['GET'])
+def get_image(digest):
+    """
+    Get a stored image by its content hash, or a resized copy of it
+    ---
+    tags:
+      - Images
+    parameters:
+      - name: digest
+        in: path
+        type: string
+        required: true
+        description: SHA-256 of the image, as found in the profile_pic URLs
+      - name: size
+        in: query
+        type: integer
+        required: false
+        description: Serve the smallest rendition (64, 256 or 1024 px) that covers this size instead of the original; only profile pictures are resized
+      - name: format
+        in: query
+        type: string
+        enum: [webp, jpeg]
+        required: false
+        description: Rendition format, by default WebP when the Accept header allows it and JPEG otherwise
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
+        description: ETag of a copy the client already has
+    responses:
+      200:
+        description: The image bytes, cacheable for a year
+        headers:
+          ETag:
+            type: string
+            description: The image hash, with the rendition size and format for resized copies
+      304:
+        description: The client's copy is current
+      404:
+        description: No image with this hash
+    """
+    if not BLOB_HASH.match(digest):
+        return jsonify({"error": "Image not found"}), 404
+
+    size = request.args.get("size", type=int)
+    if size:
+        response = _get_rendition(digest, rendition_size(size))
+        if response is not None:
+            return response
+        # Pictures that cannot be resized are served as they are
+
+    # A matching ETag needs no read at all
+    if request.if_none_match.contains_weak(digest):
+        return _not_modified(digest)
+
+    blob = blob_store.open(digest)
+    if blob is None:
+        return jsonify({"error": "Image not found"}), 404
+
+    # Recorded when the picture was saved; only blobs stored before that are sniffed
+    mime_type = profile_pic_mime_type(digest)
+    if mime_type is None:
+        mime_type = image_mime_type(blob.read(262))
+        blob.seek(0)
+    return _cached(send_file(blob, mimetype=mime_type, conditional=True), digest)
+
+
+def _get_rendition(digest, size):
+    fmt = request.args.get("format")
+    negotiated = fmt not in RENDITION_FORMATS
+    if negotiated:
+        fmt = "webp" if "image/webp" in request.accept_mimetypes.values() else "jpeg"
+
+    etag = f"{digest}-{size}-{fmt}"
+    if request.if_none_match.contains_weak(etag):
+        response = _not_modified(etag)
+    else:
+        # Only profile pictures are resized, any other stored blob is served as it is
+        if not is_profile_pic(digest):
+            return None
+        rendition = get_rendition(digest, size, fmt)
+        blob = blob_store.open(rendition.blob_hash) if rendition else None
+        if blob is None:
+            return None
+        response = _cached(send_file(blob, mimetype=RENDITION_MIME_TYPES[fmt], conditional=True), etag)
+    if negotiated:
+        response.vary.add("Accept")
+    return response
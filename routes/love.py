@@ -6,6 +6,9 @@ from core.imports import (
 from core.config import Config
 from core.extensions import db
 from core.models import User, LoveBasicInfo, UserPersonality, MatchPreference
+from core.matching import derived_columns
+from core.match_jobs import enqueue_match_job
+from core.match_store import signature_in_use
 
 
 love_bp = Blueprint('love', __name__)
@@ -125,6 +128,7 @@ def set_basic_info():
     db.session.add(new_info)
 
     user.account_type = "love"
+    enqueue_match_job("user", current_user_id)
     db.session.commit()
 
     return jsonify({"message": "User info saved successfully"}), 201
@@ -236,6 +240,7 @@ def update_basic_info():
     love_basic_info.current_location = data["currentLocation"]
     love_basic_info.skin_tone = data["skinTone"]
 
+    enqueue_match_job("user", current_user_id)
     db.session.commit()
     return jsonify({"message": "User info updated successfully"}), 200
 
@@ -379,6 +384,7 @@ responses:
         values=data["values"]
     )
     db.session.add(personality)
+    enqueue_match_job("user", current_user_id)
     db.session.commit()
 
     return jsonify({"message": "Personality set successfully"}), 201
@@ -489,6 +495,7 @@ def update_personality():
     if not user:
         return jsonify({"message": "User not found"}), 404
 
+    # Only the list fields sent are re-tokenized, the others stay deferred
     existing_personality = UserPersonality.query.filter_by(user_id=current_user_id).first()
     if not existing_personality:
         return jsonify({
@@ -496,12 +503,14 @@ def update_personality():
         }), 404
 
     updated = False
+    derived = derived_columns(UserPersonality)
     for field, value in data.items():
-        if hasattr(existing_personality, field):
+        if hasattr(existing_personality, field) and field not in derived:
             setattr(existing_personality, field, value)
             updated = True
 
     if updated:
+        enqueue_match_job("user", current_user_id)
         db.session.commit()
         return jsonify({"message": "Personality updated successfully"}), 200
     else:
@@ -653,6 +662,7 @@ def set_match_preferences():
     # Create preferences
     new_pref = MatchPreference(user_id=current_user_id, **{field: data.get(field) for field in required_fields})
     db.session.add(new_pref)
+    enqueue_match_job("user", current_user_id)
     db.session.commit()
 
     return jsonify({"message": "Match preferences saved successfully"}), 201
@@ -781,17 +791,25 @@ def update_match_preferences():
     if not user:
         return jsonify({"message": "User not found"}), 404
 
+    # Only the list fields sent are re-tokenized, the others stay deferred
     existing_pref = MatchPreference.query.filter_by(user_id=current_user_id).first()
     if not existing_pref:
         return jsonify({"message": "No match preferences found. Please set them first."}), 404
 
+    old_signature = existing_pref.signature
     updated = False
+    derived = derived_columns(MatchPreference)
     for field, value in data.items():
-        if hasattr(existing_pref, field):
+        if hasattr(existing_pref, field) and field not in derived:
             setattr(existing_pref, field, value)
             updated = True
 
     if updated:
+        db.session.flush()
+        if old_signature and existing_pref.signature != old_signature and not signature_in_use(old_signature):
+            # Nobody has the old preferences anymore, the job drops their list
+            enqueue_match_job("signature", account_type=user.account_type, signature=old_signature)
+        enqueue_match_job("user", current_user_id)
         db.session.commit()
         return jsonify({"message": "Match preferences updated successfully"}), 200
     else: